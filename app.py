@@ -7,6 +7,15 @@ from langchain_core.documents import Document
 # Import our modules
 from src.vector_store import EndeeService
 from src.ingestion import IngestionPipeline
+from src.embedding_cache import EmbeddingCache, CachedEmbeddings
+from src.stream_ingest import stream_ingest
+from src.metrics import metrics
+from src.generation import AnswerGenerator
+from src.query_service import QueryClient
+
+# With e.g. LUMINA_QUERY_SERVICE=http://127.0.0.1:8100 the UI is a thin client of
+# `python -m src.query_service`, which owns the model and the store
+QUERY_SERVICE_URL = os.environ.get("LUMINA_QUERY_SERVICE", "").strip()
 
 # Page Config
 st.set_page_config(
@@ -64,15 +73,69 @@ st.markdown("""
 @st.cache_resource
 def get_resources():
     st.write("Initializing Models and Database...")
-    embed_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    vector_store = EndeeService(collection_name="enterprise_knowledge", dimension=384)
+    model_name = "all-MiniLM-L6-v2"
+    # Chunks already embedded (e.g. on re-ingest) are served from the on-disk cache
+    embed_model = CachedEmbeddings(
+        HuggingFaceEmbeddings(model_name=model_name),
+        EmbeddingCache(model_name, path=os.path.join("data", "embedding_cache.sqlite")),
+    )
+    vector_store = EndeeService(
+        collection_name="enterprise_knowledge",
+        dimension=384,
+        persist_dir=os.path.join("data", "local_store"),
+    )
     pipeline = IngestionPipeline()
     return embed_model, vector_store, pipeline
 
+@st.cache_resource
+def get_query_client(url):
+    return QueryClient(url)
+
 if 'is_initialized' not in st.session_state:
-    st.session_state['embed_model'], st.session_state['vector_store'], st.session_state['pipeline'] = get_resources()
+    if QUERY_SERVICE_URL:
+        st.session_state['query_client'] = get_query_client(QUERY_SERVICE_URL)
+    else:
+        st.session_state['embed_model'], st.session_state['vector_store'], st.session_state['pipeline'] = get_resources()
     st.session_state['chat_history'] = []
     st.session_state['is_initialized'] = True
+service = st.session_state.get('query_client')
+
+def embed_and_store(docs):
+    """Skips chunks already stored, embeds the rest through the cache and adds them to the vector store."""
+    docs, ids = st.session_state['vector_store'].unseen(docs)
+    if docs:
+        with metrics.span("ingest.embed"):
+            embeddings = st.session_state['embed_model'].embed_documents([d.page_content for d in docs])
+        with metrics.span("ingest.insert"):
+            stats = st.session_state['vector_store'].add_documents(docs, embeddings, ids=ids)
+        if stats.failed:
+            st.warning(f"{stats.failed} chunks could not be sent to Endee and are only searchable locally.")
+    return docs
+
+def select_chunks(results):
+    """Keeps chunks that carry high semantic signal (longer, non-empty, unique)."""
+    # We want to skip Table of Contents fragments
+    best_chunks = []
+    seen_text = set()
+    for r in results:
+        txt = r['text'].strip()
+        # Skip common T.O.C. indicators
+        if any(x in txt.lower() for x in ["contents", "references", "further reading", "navigation"]):
+            continue
+        if len(txt) > 80 and txt not in seen_text:
+            best_chunks.append(r)
+            seen_text.add(txt)
+
+    # If filtering too strict, fall back to top 5 matches
+    if len(best_chunks) < 2:
+        best_chunks = results[:5]
+    return best_chunks
+
+def score_label(hit):
+    """Cosine similarity when vector search found the chunk, plus the fused score scaled to [0, 1]."""
+    if 'similarity' in hit:
+        return f"Similarity {hit['similarity']:.3f} · Relevance {hit.get('score', 0):.2f}"
+    return f"Relevance {hit.get('score', 0):.2f}"
 
 # Sidebar
 with st.sidebar:
@@ -87,43 +150,82 @@ with st.sidebar:
             urls = [u.strip() for u in url_input.split('\n') if u.strip()]
             if urls:
                 with st.spinner(f"Scraping {len(urls)} URLs..."):
-                    docs = st.session_state['pipeline'].load_web(urls)
-                    if docs:
-                        embeddings = st.session_state['embed_model'].embed_documents([d.page_content for d in docs])
-                        st.session_state['vector_store'].add_documents(docs, embeddings)
-                        st.success(f"Successfully ingested {len(docs)} chunks from {len(urls)} URLs.")
+                    if service:
+                        res = service.ingest_web(urls)
+                        n_chunks, fetch_errors = res["chunks"], res["errors"]
+                    else:
+                        docs = st.session_state['pipeline'].load_web(urls)
+                        n_chunks = len(embed_and_store(docs)) if docs else 0
+                        fetch_errors = st.session_state['pipeline'].fetch_errors
+                    if n_chunks:
+                        st.success(f"Successfully ingested {n_chunks} chunks from {len(urls)} URLs.")
+                    for url, error in fetch_errors.items():
+                        st.warning(f"Could not fetch {url}: {error}")
     
     elif upload_type == "PDF Document":
         uploaded_files = st.file_uploader("Upload PDF(s)", type=['pdf'], accept_multiple_files=True)
         if uploaded_files and st.button("Process PDF(s)"):
-            all_docs = []
-            with st.spinner(f"Parsing {len(uploaded_files)} PDF(s)..."):
+            if service:
+                with st.spinner(f"Parsing {len(uploaded_files)} PDF(s)..."):
+                    n_chunks = sum(service.ingest_pdf(f.name, f.getvalue())["chunks"] for f in uploaded_files)
+                if n_chunks:
+                    st.success(f"Successfully ingested {n_chunks} chunks from {len(uploaded_files)} files.")
+            else:
+                # Save temp with unique name per file
+                temp_paths = []
                 for uploaded_file in uploaded_files:
-                    # Save temp with unique name per file
                     temp_path = f"temp_{uploaded_file.name}"
                     with open(temp_path, "wb") as f:
                         f.write(uploaded_file.getbuffer())
-                    docs = st.session_state['pipeline'].load_pdf(temp_path)
-                    all_docs.extend(docs)
-                    # Cleanup
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                
-                if all_docs:
-                    embeddings = st.session_state['embed_model'].embed_documents([d.page_content for d in all_docs])
-                    st.session_state['vector_store'].add_documents(all_docs, embeddings)
-                    st.success(f"Successfully ingested {len(all_docs)} chunks from {len(uploaded_files)} files.")
+                    temp_paths.append(temp_path)
+
+                progress_line = st.empty()
+                with st.spinner(f"Parsing {len(uploaded_files)} PDF(s)..."):
+                    try:
+                        # Files are parsed on a process pool; chunks are embedded and
+                        # become searchable batch by batch
+                        progress = stream_ingest(
+                            st.session_state['pipeline'].iter_pdfs(temp_paths),
+                            st.session_state['embed_model'],
+                            st.session_state['vector_store'],
+                            on_batch=lambda p: progress_line.caption(
+                                f"Batch {p.batches}: {p.chunks} chunks ingested ({p.seconds:.1f}s)"
+                            ),
+                        )
+                    finally:
+                        # Cleanup
+                        for temp_path in temp_paths:
+                            if os.path.exists(temp_path):
+                                os.remove(temp_path)
+                if progress.chunks:
+                    st.success(f"Successfully ingested {progress.chunks} chunks from {len(uploaded_files)} files.")
 
     elif upload_type == "Customers Database":
         st.info("Simulating connection to SQL/CSV database (Data Source: data/customers.csv)")
         if st.button("Sync Database"):
             with st.spinner("Syncing records..."):
                 path = os.path.abspath("data/customers.csv")
-                docs = st.session_state['pipeline'].load_csv(path)
-                if docs:
-                    embeddings = st.session_state['embed_model'].embed_documents([d.page_content for d in docs])
-                    st.session_state['vector_store'].add_documents(docs, embeddings)
-                    st.success(f"Synced {len(docs)} customer records.")
+                if service:
+                    res = service.sync_csv(path)
+                else:
+                    docs = st.session_state['pipeline'].load_csv(path)
+                    res = {"records": len(docs)}
+                    if docs:
+                        # Only new or changed rows are embedded; removed rows are deleted
+                        stats = st.session_state['vector_store'].sync_source(
+                            path, docs, st.session_state['embed_model']
+                        )
+                        res.update(vars(stats))
+                if res["records"]:
+                    st.success(
+                        f"Synced {res['records']} customer records: {res['added']} added/updated, "
+                        f"{res['deleted']} removed, {res['unchanged']} unchanged."
+                    )
+                if res.get("delete_failed"):
+                    st.warning(
+                        f"{res['delete_failed']} removed records could not be deleted from Endee; "
+                        "they will be retried on the next sync."
+                    )
 
     elif upload_type == "REST API / JSON":
         json_input = st.text_area("Paste JSON / API Response", height=150, placeholder='{"key": "value"}')
@@ -131,11 +233,14 @@ with st.sidebar:
             import json
             try:
                 data = json.loads(json_input)
-                docs = st.session_state['pipeline'].load_json(data)
-                if docs:
-                    embeddings = st.session_state['embed_model'].embed_documents([d.page_content for d in docs])
-                    st.session_state['vector_store'].add_documents(docs, embeddings)
-                    st.success(f"Ingested data from JSON response.")
+                if service:
+                    if service.ingest_json(data)["chunks"]:
+                        st.success(f"Ingested data from JSON response.")
+                else:
+                    docs = st.session_state['pipeline'].load_json(data)
+                    if docs:
+                        docs = embed_and_store(docs)
+                        st.success(f"Ingested data from JSON response.")
             except Exception as e:
                 st.error(f"Invalid JSON: {e}")
 
@@ -144,17 +249,63 @@ with st.sidebar:
     oa_key = st.text_input("OpenAI API Key (Optional)", type="password", key="openai_key_input")
     if oa_key:
         st.session_state['openai_api_key'] = oa_key
+    oa_base_url = st.text_input(
+        "OpenAI-compatible Base URL (Optional)",
+        placeholder="https://api.openai.com/v1",
+        help="Any OpenAI-compatible endpoint, e.g. a local model server or the benchmarks stand-in.",
+    )
+    st.session_state['openai_base_url'] = oa_base_url.strip()
+    stream_answers = st.toggle("Stream answers", value=True, help="Render the answer token by token as it arrives.")
 
     if st.button("🗑️ Clear All Knowledge Data"):
-        st.session_state['vector_store'].clear_data()
+        if service:
+            service.clear()
+        else:
+            st.session_state['vector_store'].clear_data()
         st.success("Knowledge base cleared! You can now re-ingest fresh data.")
         st.rerun()
 
+    st.markdown("---")
+    st.markdown("### 🎯 Search Scope")
+    if service:
+        try:
+            health, known_sources = service.health(), service.sources()
+        except Exception as e:
+            health, known_sources = None, []
+            st.error(f"Query service unreachable at {QUERY_SERVICE_URL}: {e}")
+    else:
+        health = {
+            "connected": st.session_state['vector_store'].connected,
+            "items": len(st.session_state['vector_store'].local_store),
+        }
+        known_sources = st.session_state['vector_store'].local_store.field_values("source")
+    scope_sources = st.multiselect(
+        "Only answer from these sources",
+        known_sources,
+        help="Leave empty to search all knowledge.",
+    )
+
     st.markdown("---")
     st.markdown("### System Status")
-    connected = st.session_state['vector_store'].connected
-    st.markdown(f"**Endee DB Connection:** {'🟢 Online' if connected else '🔴 Offline (Mock Mode)'}")
-    st.markdown(f"**Knowledge Items:** {len(st.session_state['vector_store'].mock_store)}")
+    if service:
+        st.markdown(f"**Query Service:** {'🟢' if health else '🔴'} {QUERY_SERVICE_URL}")
+    if health:
+        st.markdown(f"**Endee DB Connection:** {'🟢 Online' if health['connected'] else '🔴 Offline (Mock Mode)'}")
+        st.markdown(f"**Knowledge Items:** {health['items']}")
+    if metrics.enabled:
+        with st.expander("⏱️ Latency & Counters"):
+            stages = metrics.stages()
+            if stages:
+                st.dataframe(stages, hide_index=True, use_container_width=True)
+            else:
+                st.caption("No timings recorded yet.")
+            for name, value in metrics.counters().items():
+                st.caption(f"`{name}`: {value:g}")
+            st.download_button(
+                "Export Prometheus metrics", metrics.prometheus(), file_name="lumina_metrics.prom", mime="text/plain"
+            )
+    else:
+        st.caption("Metrics disabled (LUMINA_METRICS=0).")
 
 # Main Chat Interface
 st.title("Lumina AI")
@@ -168,7 +319,7 @@ for msg in st.session_state['chat_history']:
         if "sources" in msg and msg["sources"]:
              with st.expander("🔍 Inspection: Source Data and Evidence"):
                  for s in msg["sources"]:
-                     st.write(f"**Relevance Track:** {s.get('score', 0):.4f}")
+                     st.write(f"**Relevance Track:** {score_label(s)}")
                      st.caption(f"Source: {s.get('metadata', {}).get('source', 'Unknown')}")
                      st.info(s.get('text'))
 
@@ -181,70 +332,74 @@ if query:
         st.markdown(query)
 
     # RAG Retrieval
+    turn_started = time.perf_counter()
     with st.spinner("Searching Endee Vector DB..."):
-        query_vec = st.session_state['embed_model'].embed_query(query)
-        # Deep search (k=15) to ensure we find technical content beyond T.O.C.
-        results = st.session_state['vector_store'].search(query_vec, k=15)
+        filters = {"source": scope_sources} if scope_sources else None
+        if service:
+            # Embedded and searched server-side, batched with other users' queries
+            with metrics.span("chat.search"):
+                results = service.search(query, k=15, filters=filters)
+        else:
+            with metrics.span("chat.embed_query"):
+                query_vec = st.session_state['embed_model'].embed_query(query)
+            # Hybrid search: vector similarity fused with BM25 keyword matches, so exact
+            # terms rank above navigation/T.O.C. fragments; k=15 leaves room for the filter below
+            with metrics.span("chat.search"):
+                results = st.session_state['vector_store'].search(
+                    query_vec,
+                    k=15,
+                    query_text=query,
+                    filters=filters,
+                )
 
     # Assistant Response
     with st.chat_message("assistant"):
-        with st.spinner("Synthesizing answer..."):
-            # Filtering: Keep chunks that carry high semantic signal (longer, non-empty, unique)
-            # We want to skip Table of Contents fragments
-            best_chunks = []
-            seen_text = set()
-            for r in results:
-                txt = r['text'].strip()
-                # Skip common T.O.C. indicators
-                if any(x in txt.lower() for x in ["contents", "references", "further reading", "navigation"]):
-                    continue
-                if len(txt) > 80 and txt not in seen_text:
-                    best_chunks.append(r)
-                    seen_text.add(txt)
-            
-            # If filtering too strict, fall back to top 5 matches
-            if len(best_chunks) < 2:
-                best_chunks = results[:5]
-            
-            # Construct Rich Context
-            context_text = "\n\n".join([f"DATA CHUNK {i+1}:\n{r['text']}" for i, r in enumerate(best_chunks)])
-            
-            # Check for OpenAI Key (Strictly clean the input)
-            api_key = str(st.session_state.get('openai_api_key', '')).strip()
+        with metrics.span("chat.filter"):
+            best_chunks = select_chunks(results)
+
+        # Check for OpenAI Key (Strictly clean the input)
+        api_key = str(st.session_state.get('openai_api_key', '')).strip()
+        base_url = st.session_state.get('openai_base_url') or None
+
+        if api_key and (base_url or api_key.startswith('sk-') or len(api_key) > 40):
+            try:
+                # Context is capped by a token budget; chunks are added in rank order
+                generator = AnswerGenerator(api_key=api_key, base_url=base_url)
+                if stream_answers:
+                    # The request goes out as soon as retrieval is done and tokens render as they arrive
+                    response = st.write_stream(generator.stream(query, best_chunks))
+                else:
+                    with st.spinner("Synthesizing answer..."):
+                        response = generator.complete(query, best_chunks)
+                    st.markdown(response)
+                stats = generator.last_stats
+                st.caption(
+                    f"First token {stats.ttft:.2f}s · total {stats.seconds:.2f}s · "
+                    f"{stats.chunks_used}/{len(best_chunks)} chunks ({stats.context_tokens} context tokens)"
+                )
+            except Exception as e:
+                metrics.inc("generation_errors_total")
+                response = f"⚠️ Generation error: {str(e)}\n\n*Falling back to local data view...*\n\n"
+                # Append local view as fallback
+                for i, r in enumerate(best_chunks[:3]):
+                    response += f"**[{i+1}]** {r['text'][:500]}...\n\n"
+                st.markdown(response)
+        else:
+            # Local Knowledge Synthesis
+            response = f"### 📊 Direct Evidence Analysis from Vector Store\n\n"
+            response += "*(Note: No valid OpenAI key detected. Showing direct matches from Endee database.)*\n\n"
+            for i, r in enumerate(best_chunks[:4]):
+                response += f"**Information Block {i+1}:**\n{r['text'][:800]}\n\n"
             
-            if api_key and (api_key.startswith('sk-') or len(api_key) > 40):
-                try:
-                    from openai import OpenAI
-                    client = OpenAI(api_key=api_key)
-                    # Using gpt-4o-mini for state-of-the-art cost-effective RAG
-                    completion = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": "You are a senior technical expert. Answer the question specifically using the provided Data Chunks. Be highly detailed and avoid mentioning 'Match numbers'. If the information is missing, explain exactly what part of the user query wasn't covered in the source text."},
-                            {"role": "user", "content": f"DATA CHUNKS:\n{context_text}\n\nUSER QUESTION: {query}"}
-                        ]
-                    )
-                    response = completion.choices[0].message.content
-                except Exception as e:
-                    response = f"⚠️ Generation error: {str(e)}\n\n*Falling back to local data view...*\n\n"
-                    # Append local view as fallback
-                    for i, r in enumerate(best_chunks[:3]):
-                        response += f"**[{i+1}]** {r['text'][:500]}...\n\n"
-            else:
-                # Local Knowledge Synthesis
-                response = f"### 📊 Direct Evidence Analysis from Vector Store\n\n"
-                response += "*(Note: No valid OpenAI key detected. Showing direct matches from Endee database.)*\n\n"
-                for i, r in enumerate(best_chunks[:4]):
-                    response += f"**Information Block {i+1}:**\n{r['text'][:800]}\n\n"
-                
-                response += "\n---\n*Synthesis produced from top semantic matches. If the results look like citations, click 'Clear All Knowledge Data' and re-ingest the URL to use the new filtered engine.*"
-
-        st.markdown(response)
+            response += "\n---\n*Synthesis produced from top semantic matches. If the results look like citations, click 'Clear All Knowledge Data' and re-ingest the URL to use the new filtered engine.*"
+            st.markdown(response)
+
+        metrics.observe("stage_seconds", time.perf_counter() - turn_started, stage="chat.turn")
         st.session_state['chat_history'].append({"role": "assistant", "content": response, "sources": best_chunks})
         
         if best_chunks:
             with st.expander("🔍 Deep Dive: Verifying Retrieval Accuracy"):
                  for i, s in enumerate(best_chunks):
-                     st.write(f"**Chunk ID:** {i+1} | **Score:** {s.get('score', 0):.4f}")
+                     st.write(f"**Chunk ID:** {i+1} | **Score:** {score_label(s)}")
                      st.caption(f"Source: {s.get('metadata',{}).get('source')}")
                      st.info(s.get('text'))
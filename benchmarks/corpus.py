@@ -0,0 +1,99 @@
+import hashlib
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+
+class SyntheticCorpus:
+    """Deterministic topic-structured text, so nearest neighbours are meaningful.
+
+    Each document draws most of its words from one of ``n_topics`` topic
+    vocabularies and the rest from a shared pool. The same seed always yields
+    the same documents, so a corpus can be regenerated instead of kept in memory.
+    """
+
+    def __init__(self, seed: int = 0, n_topics: int = 64, topic_words: int = 200,
+                 common_words: int = 2000, words_per_doc: Tuple[int, int] = (150, 600),
+                 topic_share: float = 0.7):
+        self.seed = seed
+        self.n_topics = n_topics
+        self.words_per_doc = words_per_doc
+        self.topic_share = topic_share
+        self.topics = [[f"t{t}w{i}" for i in range(topic_words)] for t in range(n_topics)]
+        self.common = [f"c{i}" for i in range(common_words)]
+
+    def _text(self, rng: np.random.Generator, topic: int, n_words: int) -> str:
+        from_topic = rng.random(n_words) < self.topic_share
+        topic_picks = rng.integers(0, len(self.topics[topic]), n_words)
+        common_picks = rng.integers(0, len(self.common), n_words)
+        return " ".join(
+            self.topics[topic][t] if use_topic else self.common[c]
+            for use_topic, t, c in zip(from_topic, topic_picks, common_picks)
+        )
+
+    def documents(self) -> Iterator[Tuple[str, dict]]:
+        """Endless stream of (text, metadata); callers stop after as many as they need."""
+        rng = np.random.default_rng(self.seed)
+        doc = 0
+        while True:
+            topic = int(rng.integers(self.n_topics))
+            n_words = int(rng.integers(*self.words_per_doc))
+            yield self._text(rng, topic, n_words), {"source": f"doc-{doc}.txt", "topic": topic}
+            doc += 1
+
+    def queries(self, n: int, words: int = 12) -> List[str]:
+        """Short topical queries, drawn from a stream independent of the documents."""
+        rng = np.random.default_rng(self.seed + 1)
+        return [self._text(rng, int(rng.integers(self.n_topics)), words) for _ in range(n)]
+
+
+def chunk_stream(corpus: SyntheticCorpus, splitter, n_chunks: int) -> Iterator[Document]:
+    """Splits corpus documents into exactly ``n_chunks`` chunks, numbered in ``metadata["chunk"]``."""
+    produced = 0
+    for text, metadata in corpus.documents():
+        for doc in splitter.create_documents([text], metadatas=[metadata]):
+            doc.metadata["chunk"] = produced
+            yield doc
+            produced += 1
+            if produced == n_chunks:
+                return
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words feature hashing; stands in for a real model in benchmarks.
+
+    Every word maps to a fixed signed bucket, so texts sharing words get similar
+    unit vectors. No model download, and identical output on every machine.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+
+    def _bucket(self, word: str) -> Tuple[int, float]:
+        found = self._buckets.get(word)
+        if found is None:
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            found = self._buckets[word] = (h % self.dimension, 1.0 if (h >> 63) & 1 else -1.0)
+        return found
+
+    def embed_matrix(self, texts: List[str]) -> np.ndarray:
+        flat, signs = [], []
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                bucket, sign = self._bucket(word)
+                flat.append(row * self.dimension + bucket)
+                signs.append(sign)
+        matrix = np.bincount(
+            np.asarray(flat, dtype=np.int64), weights=np.asarray(signs), minlength=len(texts) * self.dimension
+        ).reshape(len(texts), self.dimension).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_matrix([text])[0].tolist()
@@ -0,0 +1,123 @@
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.ann import top_k_indices
+
+
+class StandInIndex:
+    """In-process exact cosine index speaking the subset of the Endee index API EndeeService uses.
+
+    ``latency`` (seconds) is slept on every call to imitate a network round trip.
+    A ``failure_rate`` fraction of upserts raise ConnectionError after that
+    delay, so batch retries and backoff can be exercised without a server.
+    """
+
+    def __init__(self, dimension: int, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.dimension = dimension
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failed_upserts = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._metas: List[Optional[dict]] = []
+        self._filters: List[dict] = []
+        self._vectors = np.zeros((1024, dimension), dtype=np.float32)
+        self._live = np.zeros(1024, dtype=bool)
+
+    def upsert(self, records: List[Dict[str, Any]]):
+        time.sleep(self.latency)
+        with self._lock:
+            fail = self._random.random() < self.failure_rate
+            self.failed_upserts += fail
+        if fail:
+            raise ConnectionError("stand-in: simulated upsert failure")
+        vectors = np.asarray([r["vector"] for r in records], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            for record, vector in zip(records, vectors):
+                row = self._rows.get(record["id"])
+                if row is None:
+                    row = self._rows[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._metas.append(None)
+                    self._filters.append({})
+                    if row == self._vectors.shape[0]:
+                        self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+                        self._live = np.concatenate([self._live, np.zeros_like(self._live)])
+                self._vectors[row] = vector
+                self._live[row] = True
+                self._metas[row] = record.get("meta")
+                self._filters[row] = record.get("filter") or {}
+
+    def delete_vector(self, id_: str):
+        time.sleep(self.latency)
+        with self._lock:
+            row = self._rows.pop(id_, None)
+            if row is not None:
+                self._live[row] = False
+
+    def _matches(self, row: int, clauses: List[dict]) -> bool:
+        values = self._filters[row]
+        for clause in clauses:
+            for field, cond in clause.items():
+                value = values.get(field)
+                if "$eq" in cond and value != cond["$eq"]:
+                    return False
+                if "$in" in cond and value not in cond["$in"]:
+                    return False
+                if "$range" in cond and (value is None or not cond["$range"][0] <= value <= cond["$range"][1]):
+                    return False
+        return True
+
+    def query(self, vector: List[float], top_k: int = 10, filter: Optional[List[dict]] = None) -> List[Dict]:
+        time.sleep(self.latency)
+        q = np.asarray(vector, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        with self._lock:
+            n = len(self._ids)
+            live = self._live[:n].copy()
+            if filter:
+                for row in np.flatnonzero(live):
+                    live[row] = self._matches(row, filter)
+            rows = np.flatnonzero(live)
+            scores = self._vectors[rows] @ q
+            top = top_k_indices(scores, top_k)
+            return [
+                {"id": self._ids[rows[i]], "similarity": float(scores[i]), "meta": self._metas[rows[i]]}
+                for i in top
+            ]
+
+
+class StandInEndee:
+    """Client-side stand-in for ``endee.Endee``; pass it to ``EndeeService(client=...)``."""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._indexes: Dict[str, StandInIndex] = {}
+
+    def list_indexes(self) -> List[str]:
+        return list(self._indexes)
+
+    def create_index(self, name: str, dimension: int, space_type: str = "cosine"):
+        self._indexes[name] = StandInIndex(dimension, self.latency, self.failure_rate, self.seed)
+
+    def get_index(self, name: str) -> StandInIndex:
+        return self._indexes[name]
+
+    def delete_index(self, name: str):
+        self._indexes.pop(name, None)
+
+
+class OfflineEndee:
+    """A client whose server is never reachable, forcing EndeeService into fallback mode."""
+
+    def list_indexes(self):
+        raise ConnectionError("benchmark: Endee deliberately offline")
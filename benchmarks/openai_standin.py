@@ -0,0 +1,102 @@
+"""Local stand-in for an OpenAI-compatible chat completions endpoint.
+
+    python -m benchmarks.openai_standin --port 8001 --first-token-ms 400 --token-ms 20
+
+then point the app (sidebar "OpenAI-compatible Base URL") or AnswerGenerator at
+http://127.0.0.1:8001/v1 with any API key. Answers are canned but streamed with
+realistic first-token and per-token delays.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _handler(first_token_delay: float, token_delay: float, n_tokens: int):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            question = request["messages"][-1]["content"].rsplit("USER QUESTION:", 1)[-1].strip()
+            words = [f"word{i}" for i in range(n_tokens)]
+            words[:1] = [f"Answer to '{question}':"]
+            base = {"id": "chatcmpl-standin", "created": int(time.time()), "model": request.get("model", "standin")}
+
+            time.sleep(first_token_delay)
+            if not request.get("stream"):
+                time.sleep(token_delay * (n_tokens - 1))
+                self._json(200, {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": " ".join(words)}}],
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(payload: str):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(token_delay)
+                delta = {"role": "assistant", "content": word} if i == 0 else {"content": " " + word}
+                send(json.dumps({**base, "object": "chat.completion.chunk",
+                                 "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+            send(json.dumps({**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, first_token_delay: float = 0.4,
+          token_delay: float = 0.02, n_tokens: int = 200) -> ThreadingHTTPServer:
+    """Starts the stand-in on a daemon thread; ``server.server_address`` has the bound port."""
+    server = ThreadingHTTPServer((host, port), _handler(first_token_delay, token_delay, n_tokens))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible chat completions stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=200)
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.first_token_ms / 1000, args.token_ms / 1000, args.tokens)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
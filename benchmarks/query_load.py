@@ -0,0 +1,165 @@
+"""Concurrent /search load against the query service, with and without micro-batching.
+
+    python -m benchmarks.query_load --requests 400 --concurrency 64 --embed-call-ms 20
+    python -m benchmarks.query_load --url http://127.0.0.1:8100   # an already running service
+
+Without --url, an in-process service is started over the synthetic corpus, with
+an embedder that charges ``--embed-call-ms`` per call (a model forward pass),
+once per --max-batch value.
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from benchmarks.corpus import HashingEmbeddings, SyntheticCorpus, chunk_stream
+from benchmarks.endee_standin import StandInEndee
+
+
+class CallCostEmbeddings(HashingEmbeddings):
+    def __init__(self, dimension: int, call_seconds: float):
+        super().__init__(dimension)
+        self.call_seconds = call_seconds
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.call_seconds)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.call_seconds)
+        return super().embed_query(text)
+
+
+def batch_counters(url: str) -> Tuple[float, float]:
+    """(queries, batches) the service has processed so far, from its /metrics."""
+    target = urlsplit(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+    try:
+        conn.request("GET", "/metrics")
+        text = conn.getresponse().read().decode("utf-8")
+    finally:
+        conn.close()
+
+    def counter(name: str) -> float:
+        match = re.search(rf"^\w+_{name} (\S+)$", text, re.MULTILINE)
+        return float(match.group(1)) if match else 0.0
+
+    return counter("queries_total"), counter("query_batches_total")
+
+
+def load(url: str, queries: List[str], concurrency: int) -> dict:
+    """Sends the queries to /search from ``concurrency`` threads, one keep-alive connection each.
+
+    Each thread blocks on its own socket, so ``concurrency`` requests really are
+    in flight at once; a single asyncio client spent more time in its own event
+    loop than the service did, and the service never saw full batches.
+    """
+    target = urlsplit(url)
+    pending: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+    for query in queries:
+        pending.put(query)
+    latencies = []
+
+    def worker():
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        try:
+            while True:
+                try:
+                    query = pending.get_nowait()
+                except queue.Empty:
+                    return
+                body = json.dumps({"query": query, "k": 4})
+                started = time.perf_counter()
+                conn.request("POST", "/search", body, {"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    raise RuntimeError(f"/search returned {resp.status}")
+                latencies.append(time.perf_counter() - started)
+        finally:
+            conn.close()
+
+    queries_before, batches_before = batch_counters(url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    seconds = time.perf_counter() - started
+    queries_after, batches_after = batch_counters(url)
+    batches = batches_after - batches_before
+    return {
+        "qps": round(len(queries) / seconds, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        "mean_batch": round((queries_after - queries_before) / batches, 1) if batches else None,
+    }
+
+
+def start_service(max_batch: int, args):
+    from src.ingestion import IngestionPipeline
+    from src.query_service import QueryService
+    from src.vector_store import EndeeService
+
+    pipeline = IngestionPipeline()
+    docs = list(chunk_stream(SyntheticCorpus(seed=args.seed), pipeline.text_splitter, args.chunks))
+    with contextlib.redirect_stdout(io.StringIO()):
+        vector_store = EndeeService("bench_query_load", dimension=args.dimension, client=StandInEndee())
+        vector_store.add_documents(
+            docs, HashingEmbeddings(args.dimension).embed_documents([d.page_content for d in docs])
+        )
+    embed_model = CallCostEmbeddings(args.dimension, args.embed_call_ms / 1000)
+    service = QueryService(embed_model, vector_store, pipeline, max_batch=max_batch, max_wait_ms=args.max_wait_ms)
+
+    ready = threading.Event()
+
+    async def run():
+        started = asyncio.Event()
+        task = asyncio.create_task(service.serve("127.0.0.1", 0, started))
+        await started.wait()
+        ready.set()
+        await task
+
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{service.port}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark a running service instead of an in-process one")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--embed-call-ms", type=float, default=20.0)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    queries = SyntheticCorpus(seed=args.seed).queries(args.requests)
+    if args.url:
+        results = {"external": load(args.url, queries, args.concurrency)}
+    else:
+        results = {
+            f"max_batch={max_batch}": load(start_service(max_batch, args), queries, args.concurrency)
+            for max_batch in args.max_batch
+        }
+    print(json.dumps({"config": vars(args), "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Retrieval and ingestion benchmarks for EndeeService.
+
+Run from the repository root:
+
+    python -m benchmarks.run --chunks 20000 --queries 200 --output bench.json
+    python -m benchmarks.run --chunks 20000 --baseline bench.json   # exit 1 on regression
+
+Every mode runs in a fresh process over the same synthetic corpus and hashed
+embeddings, so results are comparable between versions and machines of a kind.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from benchmarks.corpus import HashingEmbeddings, SyntheticCorpus, chunk_stream
+from benchmarks.endee_standin import OfflineEndee, StandInEndee
+from src.ann import recall_at_k, top_k_indices_batch
+
+MODES = ("fallback", "standin", "endee")
+# metric path -> True when higher is better
+TRACKED = {
+    ("ingest", "chunks_per_sec"): True,
+    ("search", "p50_ms"): False,
+    ("search", "p99_ms"): False,
+    ("search", "recall_at_k"): True,
+    ("search", "batch_qps"): True,
+    ("memory", "peak_rss_mb"): False,
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def exact_neighbours(corpus: SyntheticCorpus, splitter, embedder: HashingEmbeddings, n_chunks: int,
+                     queries: np.ndarray, k: int, block: int = 8192) -> List[List[int]]:
+    """Brute-force top-k chunk numbers, regenerating the corpus block by block to bound memory."""
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_chunks = np.empty((len(queries), 0), dtype=np.int64)
+    docs = chunk_stream(corpus, splitter, n_chunks)
+    while True:
+        batch = [doc for _, doc in zip(range(block), docs)]
+        if not batch:
+            break
+        scores = np.hstack([best_scores, queries @ embedder.embed_matrix([d.page_content for d in batch]).T])
+        chunks = np.hstack([best_chunks, np.array([[d.metadata["chunk"] for d in batch]] * len(queries))])
+        top = top_k_indices_batch(scores, k)
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_chunks = np.take_along_axis(chunks, top, axis=1)
+    return best_chunks.tolist()
+
+
+def percentile_ms(seconds: List[float], q: float) -> float:
+    return round(float(np.percentile(seconds, q)) * 1000, 3)
+
+
+def run_mode(mode: str, config: dict) -> dict:
+    """Ingests the corpus through one service configuration, then measures search."""
+    # Imported here so the parent process stays small and peak memory is per mode
+    from src.ingestion import IngestionPipeline
+    from src.metrics import metrics
+    from src.stream_ingest import stream_ingest
+    from src.vector_store import EndeeService
+
+    corpus = SyntheticCorpus(seed=config["seed"])
+    embedder = HashingEmbeddings(config["dimension"])
+    splitter = IngestionPipeline().text_splitter
+    client = {
+        "fallback": OfflineEndee(),
+        "standin": StandInEndee(config["latency_ms"] / 1000, config["failure_rate"], config["seed"]),
+    }.get(mode)
+    collection = f"bench_{os.getpid()}"
+
+    with contextlib.ExitStack() as stack:
+        # The service reports progress with print(); keep it out of the JSON on stdout
+        stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        persist_dir = stack.enter_context(tempfile.TemporaryDirectory()) if config["persist"] else None
+        service = EndeeService(
+            collection, dimension=config["dimension"], persist_dir=persist_dir,
+            local_index=config["local_index"], nprobe=config["nprobe"], quantization=config["quantization"],
+            base_url=config["endee_url"] if mode == "endee" else None, client=client,
+        )
+        if mode != "fallback" and not service.connected:
+            raise RuntimeError(f"{mode}: could not connect to Endee")
+        try:
+            progress = stream_ingest(
+                chunk_stream(corpus, splitter, config["chunks"]), embedder, service,
+                batch_size=config["batch_size"], dedupe=False,
+            )
+
+            queries = embedder.embed_matrix(corpus.queries(config["queries"]))
+            truth = exact_neighbours(corpus, splitter, embedder, config["chunks"], queries, config["k"])
+            for q in queries[:10]:
+                service.search(q.tolist(), config["k"])  # warm lazy indexes
+
+            latencies, found = [], []
+            for q in queries:
+                started = time.perf_counter()
+                results = service.search(q.tolist(), config["k"])
+                latencies.append(time.perf_counter() - started)
+                found.append([r["metadata"].get("chunk") for r in results])
+
+            started = time.perf_counter()
+            service.search_batch(queries.tolist(), config["k"])
+            batch_seconds = time.perf_counter() - started
+            memory_per_chunk = service.local_store.memory_per_chunk()
+        finally:
+            if mode == "endee":
+                service.client.delete_index(collection)
+            service.local_store.close()
+
+    return {
+        "mode": mode,
+        "connected": service.connected,
+        "ingest": {
+            "chunks": progress.chunks,
+            "seconds": round(progress.seconds, 3),
+            "chunks_per_sec": round(progress.chunks / progress.seconds, 1) if progress.seconds else 0.0,
+            "insert_retries": metrics.counters().get("insert_retries_total", 0),
+            "insert_failures": metrics.counters().get("insert_failures_total", 0),
+        },
+        "search": {
+            "queries": len(queries),
+            "k": config["k"],
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+            "mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+            "recall_at_k": round(recall_at_k(truth, found), 4),
+            "batch_qps": round(len(queries) / batch_seconds, 1) if batch_seconds else 0.0,
+        },
+        "memory": {
+            "peak_rss_mb": peak_rss_mb(),
+            "index_bytes_per_chunk": memory_per_chunk["total"],
+            "resident_bytes_per_chunk": memory_per_chunk["resident"],
+        },
+    }
+
+
+def compare(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """Tracked metrics that got worse than the baseline by more than ``tolerance`` (a fraction)."""
+    previous = {r["mode"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result["mode"])
+        if not old:
+            continue
+        for (section, metric), higher_is_better in TRACKED.items():
+            before, after = old.get(section, {}).get(metric), result[section].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{result['mode']} {section}.{metric}: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=20_000, help="corpus size in chunks")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--batch-size", type=int, default=64, help="ingest batch size")
+    parser.add_argument("--modes", default="fallback,standin",
+                        help=f"comma-separated subset of {','.join(MODES)}; 'endee' needs a running server")
+    parser.add_argument("--local-index", choices=("flat", "ivf"), default="flat")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--quantization", choices=("none", "float16", "int8"), default="none")
+    parser.add_argument("--persist", action="store_true", help="use a memory-mapped local store on disk")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated round trip of the stand-in")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of stand-in upserts that fail")
+    parser.add_argument("--endee-url", default=None, help="base URL of a real Endee server for mode 'endee'")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown, e.g. 0.15")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    config = {
+        key: getattr(args, key)
+        for key in ("chunks", "queries", "k", "dimension", "batch_size", "local_index", "nprobe",
+                    "quantization", "persist", "latency_ms", "failure_rate", "endee_url", "seed")
+    }
+
+    results = []
+    for mode in modes:
+        # One fresh process per mode keeps peak memory and warm caches independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results.append(pool.submit(run_mode, mode, config).result())
+        print(f"{mode}: done", file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("warning: baseline was run with a different configuration", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Time-to-first-token of streamed vs blocking generation, against the local OpenAI stand-in.
+
+    python -m benchmarks.ttft --runs 10 --chunks 15
+"""
+import argparse
+import json
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from benchmarks.openai_standin import serve
+from src.generation import AnswerGenerator
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--chunks", type=int, default=15, help="retrieved chunks offered as context")
+    parser.add_argument("--context-tokens", type=int, default=3000)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--base-url", help="measure a real endpoint instead of the stand-in")
+    parser.add_argument("--api-key", default="standin")
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = serve(first_token_delay=args.first_token_ms / 1000, token_delay=args.token_ms / 1000,
+                       n_tokens=args.tokens)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    generator = AnswerGenerator(api_key=args.api_key, base_url=base_url, context_tokens=args.context_tokens)
+    chunks = [{"text": f"Chunk {i}. " + "lorem ipsum dolor sit amet " * 200} for i in range(args.chunks)]
+
+    results = {}
+    for mode in ("stream", "blocking"):
+        ttfts, totals = [], []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            if mode == "stream":
+                for _ in generator.stream("What is in the data?", chunks):
+                    pass
+            else:
+                generator.complete("What is in the data?", chunks)
+            totals.append(time.perf_counter() - started)
+            ttfts.append(generator.last_stats.ttft)
+        results[mode] = {
+            "ttft_p50_ms": round(float(np.percentile(ttfts, 50)) * 1000, 1),
+            "ttft_p99_ms": round(float(np.percentile(ttfts, 99)) * 1000, 1),
+            "total_p50_ms": round(float(np.percentile(totals, 50)) * 1000, 1),
+            "chunks_used": generator.last_stats.chunks_used,
+            "context_tokens": generator.last_stats.context_tokens,
+        }
+    if server:
+        server.shutdown()
+    print(json.dumps({"config": vars(args) | {"api_key": None}, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
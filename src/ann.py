@@ -0,0 +1,126 @@
+import numpy as np
+from typing import Callable, List, Optional
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, using partial selection."""
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def top_k_indices_batch(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise top_k_indices for a (queries, rows) score matrix."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def recall_at_k(exact: List[List[int]], approx: List[List[int]]) -> float:
+    """Mean fraction of the exact top-k rows that the approximate search also returned."""
+    if not exact:
+        return 1.0
+    hits = [len(set(e) & set(a)) / len(e) for e, a in zip(exact, approx) if len(e)]
+    return float(np.mean(hits)) if hits else 1.0
+
+
+class IVFIndex:
+    """IVF-flat index over unit-normalised rows, trained with spherical k-means.
+
+    Rows are bucketed by nearest centroid; a query scores the centroids, then
+    scans only the ``nprobe`` closest lists exactly. Raising ``nprobe`` trades
+    speed for recall (``nprobe == n_lists`` is an exact scan).
+    """
+
+    def __init__(self, dimension: int, n_lists: Optional[int] = None, nprobe: int = 8,
+                 n_iter: int = 10, max_train: int = 100_000, seed: int = 0):
+        self.dimension = dimension
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.max_train = max_train
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self.trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, vectors: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        out = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk):
+            out[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ self.centroids.T, axis=1)
+        return out
+
+    def build(self, vectors: np.ndarray):
+        """(Re)trains centroids on a sample of ``vectors`` and reassigns every row."""
+        n = vectors.shape[0]
+        if n == 0:
+            self.reset()
+            return
+        n_lists = self.n_lists or int(np.clip(4 * np.sqrt(n), 1, 65536))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[rng.choice(n, size=min(n, max(self.max_train, n_lists)), replace=False)]
+        self.centroids = np.array(sample[rng.choice(sample.shape[0], size=n_lists, replace=False)])
+        for _ in range(self.n_iter):
+            labels = self._assign(sample)
+            order = np.argsort(labels, kind="stable")
+            # Empty clusters keep their previous centroid
+            filled, starts = np.unique(labels[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1)
+            nonzero = norms > 0
+            self.centroids[filled[nonzero]] = sums[nonzero] / norms[nonzero, None]
+
+        labels = self._assign(vectors)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+        self.trained_size = n
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        """Appends new rows to their nearest existing list without retraining."""
+        labels = self._assign(vectors)
+        for list_id in np.unique(labels):
+            self.lists[list_id] = np.concatenate([self.lists[list_id], rows[labels == list_id]])
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        probe = top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([self.lists[i] for i in probe])
+
+    def search(self, score_rows: Callable[[np.ndarray, np.ndarray], np.ndarray], query: np.ndarray,
+               k: int, nprobe: Optional[int] = None, deleted: Optional[np.ndarray] = None):
+        """Returns (rows, scores) of the approximate top-k for a unit-normalised query.
+
+        ``score_rows(rows, query)`` scores the candidate rows, which lets the
+        caller scan float32 rows or quantized codes. Rows flagged in the
+        ``deleted`` mask are skipped.
+        """
+        cand = self.candidates(query, nprobe)
+        if deleted is not None:
+            cand = cand[~deleted[cand]]
+        sims = score_rows(cand, query)
+        top = top_k_indices(sims, k)
+        return cand[top], sims[top]
+
+    def reset(self):
+        self.centroids = None
+        self.lists = []
+        self.trained_size = 0
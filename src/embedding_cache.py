@@ -0,0 +1,107 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import List, Dict
+
+from langchain_core.embeddings import Embeddings
+
+
+def content_hash(*parts: str) -> str:
+    """Hex sha256 of the parts joined by NUL: the one content key behind cache keys, chunk ids and dedup."""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent, size-bounded LRU cache of embeddings keyed by model name and text hash.
+
+    Backed by SQLite so entries survive restarts; once more than ``max_entries``
+    vectors are stored, the least recently used ones are evicted.
+    """
+
+    def __init__(self, model_name: str, path: str = ":memory:", max_entries: int = 500_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Shared across Streamlit sessions, which run on different threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used)")
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        return content_hash(self.model_name, text)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})", [time.time(), *chunk]
+                )
+            self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        now = time.time()
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (excess,)
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model so documents are only embedded once per distinct text."""
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(t) for t in texts]
+        vectors = self.cache.get_many(keys)
+        # Identical texts inside the batch are embedded once
+        missing = {k: t for k, t in zip(keys, texts) if k not in vectors}
+        if missing:
+            fresh = dict(zip(missing, self.underlying.embed_documents(list(missing.values()))))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+        return [vectors[k] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries are rarely repeated verbatim and some models embed them differently
+        return self.underlying.embed_query(text)
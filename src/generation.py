@@ -0,0 +1,116 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.metrics import metrics
+
+SYSTEM_PROMPT = (
+    "You are a senior technical expert. Answer the question specifically using the provided Data Chunks. "
+    "Be highly detailed and avoid mentioning 'Match numbers'. If the information is missing, explain exactly "
+    "what part of the user query wasn't covered in the source text."
+)
+DEFAULT_MODEL = "gpt-4o-mini"
+# Leaves room for the system prompt, the question and a long answer in small-context models
+DEFAULT_CONTEXT_TOKENS = 3000
+
+
+@dataclass
+class GenerationStats:
+    ttft: float = 0.0
+    seconds: float = 0.0
+    chunks_used: int = 0
+    context_tokens: int = 0
+
+
+def token_counter(model: str = DEFAULT_MODEL) -> Tuple[Callable[[str], int], Callable[[str, int], str]]:
+    """(count, truncate) functions for ``model``; tiktoken when installed, else ~4 chars per token."""
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return (
+            lambda text: len(encoding.encode(text, disallowed_special=())),
+            lambda text, n: encoding.decode(encoding.encode(text, disallowed_special=())[:n]),
+        )
+    except ImportError:
+        return (lambda text: (len(text) + 3) // 4, lambda text, n: text[:n * 4])
+
+
+class AnswerGenerator:
+    """Grounded answers from an OpenAI-compatible chat endpoint, streamed or in one piece.
+
+    Context is filled with retrieved chunks in rank order until ``context_tokens``
+    is spent. ``base_url`` points the client at any OpenAI-compatible server (a
+    local stand-in, a proxy, a self-hosted model); ``client`` injects one directly.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 model: str = DEFAULT_MODEL, context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                 client: Any = None):
+        self.model = model
+        self.context_tokens = context_tokens
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI(api_key=api_key, base_url=base_url)
+        self.client = client
+        self._count, self._truncate = token_counter(model)
+        self.last_stats = GenerationStats()
+
+    def build_context(self, chunks: List[Dict]) -> Tuple[str, int, int]:
+        """Returns (context text, chunks used, tokens used) within the token budget."""
+        blocks, used = [], 0
+        for i, chunk in enumerate(chunks):
+            block = f"DATA CHUNK {i+1}:\n{chunk['text']}"
+            tokens = self._count(block) + 2  # blank line between blocks
+            if used + tokens > self.context_tokens:
+                if not blocks:
+                    # A single oversized chunk is cut rather than dropped
+                    block = self._truncate(block, self.context_tokens)
+                    blocks.append(block)
+                    used = self._count(block)
+                break
+            blocks.append(block)
+            used += tokens
+        return "\n\n".join(blocks), len(blocks), used
+
+    def _messages(self, query: str, chunks: List[Dict]) -> List[Dict[str, str]]:
+        context_text, used, tokens = self.build_context(chunks)
+        self.last_stats = GenerationStats(chunks_used=used, context_tokens=tokens)
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"DATA CHUNKS:\n{context_text}\n\nUSER QUESTION: {query}"},
+        ]
+
+    def stream(self, query: str, chunks: List[Dict]) -> Iterator[str]:
+        """Yields answer text as it arrives; ``last_stats`` holds the timings once exhausted."""
+        messages = self._messages(query, chunks)
+        stats = self.last_stats
+        started = time.perf_counter()
+        response = self.client.chat.completions.create(model=self.model, messages=messages, stream=True)
+        for event in response:
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if not delta:
+                continue
+            if not stats.ttft:
+                stats.ttft = time.perf_counter() - started
+                metrics.observe("stage_seconds", stats.ttft, stage="chat.first_token")
+            yield delta
+        stats.seconds = time.perf_counter() - started
+        if not stats.ttft:
+            stats.ttft = stats.seconds
+        metrics.observe("stage_seconds", stats.seconds, stage="chat.generate")
+
+    def complete(self, query: str, chunks: List[Dict]) -> str:
+        """Blocking variant: the whole answer at once."""
+        messages = self._messages(query, chunks)
+        started = time.perf_counter()
+        completion = self.client.chat.completions.create(model=self.model, messages=messages)
+        self.last_stats.seconds = self.last_stats.ttft = time.perf_counter() - started
+        metrics.observe("stage_seconds", self.last_stats.seconds, stage="chat.generate")
+        return completion.choices[0].message.content
@@ -0,0 +1,128 @@
+import functools
+import re
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+# Boilerplate and citation markup dropped before any text is extracted
+NOISE_TAGS = ("script", "style", "noscript", "template", "iframe", "svg", "nav", "footer", "aside")
+NOISE_CLASSES = (
+    "reflist", "references", "reference", "navbox", "infobox", "sitenotice",
+    "mw-editsection", "mw-jump-link", "noprint", "toc",
+)
+NOISE_IDS = ("catlinks", "toc")
+# Elements that start a new line, so text from separate paragraphs/cells never runs together
+BLOCK_TAGS = (
+    "p", "div", "section", "article", "main", "header", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr",
+    "td", "th", "pre", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "br", "hr", "figcaption",
+)
+# Reference-list residue and inline markers such as "[12]" or "[citation needed]"
+CITATION_LINE = re.compile(r"Retrieved on|ISBN|doi:|arXiv:")
+INLINE_CITATION = re.compile(r"\[(?:\d+|citation needed)\]")
+
+
+@functools.lru_cache(maxsize=None)
+def _lxml_noise():
+    """Compiled XPath matching every noise element, or None when lxml is not installed."""
+    try:
+        from lxml import etree
+    except ImportError:
+        return None
+    paths = [f"//{tag}" for tag in NOISE_TAGS]
+    paths += [f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]" for cls in NOISE_CLASSES]
+    paths += [f"//*[@id='{id_}']" for id_ in NOISE_IDS]
+    return etree.XPath(" | ".join(paths))
+
+
+def _clean_lines(text: str) -> str:
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(INLINE_CITATION.sub("", line).split())
+        if line and not CITATION_LINE.search(line):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _extract_lxml(html: str, noise) -> Tuple[str, Dict[str, str]]:
+    import lxml.html
+    from lxml.etree import ParserError
+
+    try:
+        root = lxml.html.document_fromstring(html)
+    except ValueError:
+        # Strings carrying an XML encoding declaration must be parsed as bytes
+        root = lxml.html.document_fromstring(html.encode("utf-8"))
+    except ParserError:
+        return "", {}
+
+    metadata = {}
+    title = root.find(".//title")
+    if title is not None:
+        metadata["title"] = title.text_content()
+    description = root.xpath("//meta[@name='description']/@content")
+    if description:
+        metadata["description"] = description[0]
+    if root.get("lang"):
+        metadata["language"] = root.get("lang")
+
+    for element in noise(root):
+        # The root cannot be dropped (lxml asserts); a noise class on <html> marks nothing useful anyway
+        if element.getparent() is not None:
+            element.drop_tree()
+    for element in root.iter(*BLOCK_TAGS):
+        element.text = "\n" + (element.text or "")
+        element.tail = "\n" + (element.tail or "")
+    body = root.find("body")
+    return (body if body is not None else root).text_content(), metadata
+
+
+def _extract_bs4(html: str) -> Tuple[str, Dict[str, str]]:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    metadata = {}
+    if soup.title:
+        metadata["title"] = soup.title.get_text()
+    description = soup.find("meta", attrs={"name": "description"})
+    if description and description.get("content"):
+        metadata["description"] = description["content"]
+    html_tag = soup.find("html")
+    if html_tag and html_tag.get("lang"):
+        metadata["language"] = html_tag["lang"]
+
+    noise_classes = set(NOISE_CLASSES)
+
+    def is_noise(tag) -> bool:
+        return (tag.name in NOISE_TAGS or tag.get("id") in NOISE_IDS
+                or not noise_classes.isdisjoint(tag.get("class") or ()))
+
+    # A plain predicate walk; CSS selectors through soupsieve are several times slower
+    for element in soup.find_all(is_noise):
+        # Keep the root element, as the lxml path must
+        if not element.decomposed and element.parent is not soup:
+            element.decompose()
+    for element in soup.find_all(BLOCK_TAGS):
+        # Inside the element: insert_before/after would search the parent's children each time
+        element.insert(0, "\n")
+        element.append("\n")
+    return (soup.body or soup).get_text(), metadata
+
+
+def extract_document(url: str, html: str) -> Document:
+    """Cleans raw HTML in one parse: drops boilerplate and citation markup, keeps block structure.
+
+    Uses lxml when installed and falls back to BeautifulSoup's html.parser.
+    Metadata mirrors WebBaseLoader (source, title, description, language).
+    """
+    noise = _lxml_noise()
+    text, found = _extract_lxml(html, noise) if noise is not None else _extract_bs4(html)
+    metadata = {"source": url, "loader": "web", **found}
+    return Document(page_content=_clean_lines(text), metadata=metadata)
+
+
+def extract_and_split(url: str, html: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """Process-pool worker: extracts one page and splits it into chunks."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    return splitter.split_documents([extract_document(url, html)])
@@ -1,52 +1,193 @@
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader, WebBaseLoader, CSVLoader
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Iterator, Optional, Tuple
+from langchain_community.document_loaders import PyPDFLoader, CSVLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from src.html_extract import extract_and_split
+from src.metrics import metrics
+from src.web_fetch import fetch_urls
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Pools are started from loader and server threads of a process that already runs
+# torch and HTTP client threads; forking it could copy a held lock into a worker
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+# Below this many pages, extracting inline beats shipping them to the (already running) extraction pool
+MIN_PARALLEL_PAGES = 4
+
+
+def _split_pdf_pages(path: str, start: int, end: int, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """Process-pool worker: extracts pages [start, end) of a PDF and splits them."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    total = len(reader.pages)
+    pages = [
+        Document(
+            page_content=reader.pages[i].extract_text(),
+            metadata={"source": path, "page": i, "total_pages": total, "loader": "pdf"},
+        )
+        for i in range(start, end)
+    ]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    return splitter.split_documents(pages)
+
+
 class IngestionPipeline:
     def __init__(self):
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
             length_function=len,
         )
+        # Per-URL failures from the last load_web call
+        self.fetch_errors: Dict[str, str] = {}
+        # Web extraction pools by worker count, started on first use and kept: a spawn
+        # pool costs over a second to start, far more than extracting a few pages
+        self._extract_pools: Dict[int, ProcessPoolExecutor] = {}
+        self._pools_lock = threading.Lock()
+
+    def _extract_pool(self, workers: int) -> ProcessPoolExecutor:
+        with self._pools_lock:
+            pool = self._extract_pools.get(workers)
+            if pool is None:
+                pool = self._extract_pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT)
+            return pool
+
+    def _drop_extract_pool(self, workers: int, pool: ProcessPoolExecutor) -> None:
+        """Forgets a pool whose worker died so the next call starts a fresh one."""
+        with self._pools_lock:
+            if self._extract_pools.get(workers) is pool:
+                del self._extract_pools[workers]
+        pool.shutdown(wait=False)
+
+    def _extract_inline(self, pages: List[Tuple[str, str]]) -> list:
+        results = []
+        for url, html in pages:
+            try:
+                results.append(extract_and_split(url, html, CHUNK_SIZE, CHUNK_OVERLAP))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _tag(self, docs: List[Document], loader: str) -> List[Document]:
+        """Records which loader produced each document, for metadata filtering."""
+        for doc in docs:
+            doc.metadata["loader"] = loader
+        return docs
 
     def load_pdf(self, path: str) -> List[Document]:
         try:
             loader = PyPDFLoader(path)
-            docs = loader.load()
-            return self.text_splitter.split_documents(docs)
+            with metrics.span("ingest.load_pdf"):
+                docs = loader.load()
+            with metrics.span("ingest.split"):
+                return self.text_splitter.split_documents(self._tag(docs, "pdf"))
         except Exception as e:
             print(f"Error loading PDF {path}: {e}")
             return []
 
-    def load_web(self, urls: List[str]) -> List[Document]:
+    def _pdf_tasks(self, paths: List[str], pages_per_task: int) -> Iterator[Tuple[str, int, int]]:
+        from pypdf import PdfReader
+
+        for path in paths:
+            try:
+                total = len(PdfReader(path).pages)
+            except Exception as e:
+                print(f"Error loading PDF {path}: {e}")
+                continue
+            for start in range(0, total, pages_per_task):
+                yield path, start, min(start + pages_per_task, total)
+
+    def iter_pdfs(self, paths: List[str], max_workers: Optional[int] = None,
+                  pages_per_task: int = 32) -> Iterator[Document]:
+        """Parses and splits PDFs on a process pool, yielding chunks in file/page order.
+
+        Large files are cut into page ranges of ``pages_per_task`` so they spread
+        across workers too. Only a couple of tasks per worker are in flight at once.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=POOL_CONTEXT) as pool:
+            pending = deque()
+
+            def next_result():
+                task, future = pending.popleft()
+                try:
+                    return future.result()
+                except Exception as e:
+                    print(f"Error loading PDF {task[0]} pages {task[1]}-{task[2]}: {e}")
+                    return []
+
+            for task in self._pdf_tasks(paths, pages_per_task):
+                pending.append((task, pool.submit(_split_pdf_pages, *task, CHUNK_SIZE, CHUNK_OVERLAP)))
+                if len(pending) >= 2 * max_workers:
+                    yield from next_result()
+            while pending:
+                yield from next_result()
+
+    def load_pdfs(self, paths: List[str], max_workers: Optional[int] = None,
+                  pages_per_task: int = 32) -> List[Document]:
+        return list(self.iter_pdfs(paths, max_workers=max_workers, pages_per_task=pages_per_task))
+
+    def load_web(self, urls: List[str], concurrent: bool = True, max_workers: Optional[int] = None,
+                 **fetch_options) -> List[Document]:
+        """Scrapes URLs and returns cleaned chunks.
+
+        Raw HTML is fetched with a pooled async httpx client (see src.web_fetch;
+        concurrent=False fetches one URL at a time) and fetch_options are passed
+        through to it. Each page is then cleaned in a single parse and split (see
+        src.html_extract), on a long-lived process pool when there are enough pages
+        and more than one worker to pay for it. Failed URLs are skipped and recorded in self.fetch_errors instead
+        of failing the whole batch.
+        """
+        self.fetch_errors = {}
         try:
-            from langchain_community.document_loaders import WebBaseLoader
-            from bs4 import BeautifulSoup
-            import bs4
-            
-            # Using custom BeautifulSoup parsing to remove 'noise'
-            loader = WebBaseLoader(web_paths=urls)
-            docs = loader.load()
-            
-            cleaned_docs = []
-            for doc in docs:
-                soup = BeautifulSoup(doc.page_content, 'html.parser')
-                
-                # REMOVE NOISE: References, Navboxes, Sidebars
-                for noise in soup.select('.reflist, .navbox, .infobox, .sitenotice, #catlinks, .reference, .mw-editsection'):
-                    noise.decompose()
-                
-                # Get the cleaned text
-                text = soup.get_text(separator=' ', strip=True)
-                
-                # Filter out lines that look like citations (e.g., [1], ^, Retrieved on)
-                lines = [line for line in text.splitlines() if not any(x in line for x in ["Retrieved on", "ISBN", "doi:", "arXiv:"])]
-                doc.page_content = "\n".join(lines)
-                cleaned_docs.append(doc)
-
-            return self.text_splitter.split_documents(cleaned_docs)
+            if not concurrent:
+                fetch_options = {**fetch_options, "max_connections": 1, "max_per_host": 1}
+            pages = []
+            with metrics.span("ingest.fetch"):
+                fetched = fetch_urls(urls, **fetch_options)
+            for res in fetched:
+                if res.ok:
+                    pages.append((res.url, res.text))
+                else:
+                    print(f"Error loading URL {res.url}: {res.error}")
+                    metrics.inc("fetch_failures_total")
+                    self.fetch_errors[res.url] = res.error
+
+            workers = max_workers or os.cpu_count() or 1
+            with metrics.span("ingest.extract"):
+                if len(pages) < MIN_PARALLEL_PAGES or workers == 1:
+                    results = self._extract_inline(pages)
+                else:
+                    pool = self._extract_pool(workers)
+                    try:
+                        futures = [
+                            pool.submit(extract_and_split, url, html, CHUNK_SIZE, CHUNK_OVERLAP)
+                            for url, html in pages
+                        ]
+                        results = [f.exception() or f.result() for f in futures]
+                    except BrokenProcessPool:
+                        results = None
+                    if results is None or any(isinstance(r, BrokenProcessPool) for r in results):
+                        # A worker died (e.g. OOM-killed); retry this batch inline
+                        self._drop_extract_pool(workers, pool)
+                        results = self._extract_inline(pages)
+
+            chunks = []
+            for (url, _), result in zip(pages, results):
+                if isinstance(result, Exception):
+                    print(f"Error extracting {url}: {result}")
+                    self.fetch_errors[url] = f"Could not extract text: {result}"
+                else:
+                    chunks.extend(result)
+            return chunks
         except Exception as e:
             print(f"Error loading URLs {urls}: {e}")
             return []
@@ -54,9 +195,11 @@ class IngestionPipeline:
     def load_csv(self, path: str) -> List[Document]:
         try:
             loader = CSVLoader(path)
-            docs = loader.load()
+            with metrics.span("ingest.load_csv"):
+                docs = loader.load()
             # CSV rows are usually small, but splitting is safe
-            return self.text_splitter.split_documents(docs)
+            with metrics.span("ingest.split"):
+                return self.text_splitter.split_documents(self._tag(docs, "csv"))
         except Exception as e:
             print(f"Error loading CSV {path}: {e}")
             return []
@@ -66,7 +209,7 @@ class IngestionPipeline:
         import json
         try:
             text = json.dumps(data, indent=2)
-            doc = Document(page_content=text, metadata={"source": source_name})
+            doc = Document(page_content=text, metadata={"source": source_name, "loader": "json"})
             return self.text_splitter.split_documents([doc])
         except Exception as e:
             print(f"Error processing JSON: {e}")
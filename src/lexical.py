@@ -0,0 +1,189 @@
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.ann import top_k_indices
+
+# Letter/digit runs in any script, keeping joined identifiers such as "CUST-00123"
+# or "ERR_42.7" whole; [^\W_] is \w without the underscore, which joins parts instead
+_TOKEN = re.compile(r"[^\W_]+(?:[-_.][^\W_]+)*", re.UNICODE)
+_PART = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens; joined identifiers also yield their parts ("cust-00123", "cust", "00123")."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(_PART.findall(token))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict]], k: int, rrf_k: int = 60) -> List[Dict]:
+    """Fuses ranked result lists by id with RRF.
+
+    ``score`` becomes the fused score scaled to [0, 1], where 1.0 means ranked
+    first in every list; raw RRF sums (~0.03) mean nothing to a reader.
+    """
+    fused: Dict[str, float] = {}
+    first_seen: Dict[str, Dict] = {}
+    for ranking in rankings:
+        for rank, res in enumerate(ranking):
+            fused[res["id"]] = fused.get(res["id"], 0.0) + 1.0 / (rrf_k + rank + 1)
+            first_seen.setdefault(res["id"], res)
+    best = sorted(fused, key=fused.get, reverse=True)[:k]
+    top = len(rankings) / (rrf_k + 1)
+    return [dict(first_seen[id_], score=fused[id_] / top) for id_ in best]
+
+
+class BM25Index:
+    """Append-only inverted index over row numbers with vectorised BM25 scoring.
+
+    Terms get integer ids in first-seen order (``terms``). Postings rebuilt
+    with ``from_entries`` sit in flat CSR arrays; rows added afterwards go to
+    compact per-term ``array`` buffers. A query only touches the posting
+    lists of its own terms, copied out of those buffers. Not thread-safe:
+    callers serialise ``add`` and ``search`` (LocalVectorStore holds its
+    lock around both).
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: List[str] = []
+        self._term_ids: Dict[str, int] = {}
+        # CSR postings: rows/tfs of term t are [_ptr[t], _ptr[t + 1]); later terms have none here
+        self._ptr = np.zeros(1, dtype=np.int64)
+        self._csr_rows = np.empty(0, dtype=np.uint32)
+        self._csr_tfs = np.empty(0, dtype=np.uint32)
+        # Postings of rows added since, per term id
+        self._rows: Dict[int, array] = {}
+        self._tfs: Dict[int, array] = {}
+        self._lengths = array("I")
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @classmethod
+    def from_entries(cls, terms: List[str], ends: np.ndarray, term_ids: np.ndarray, tfs: np.ndarray,
+                     **params) -> "BM25Index":
+        """Rebuilds an index from forward entries, as ``encode`` produced them.
+
+        Row r's (term id, tf) pairs are ``term_ids``/``tfs`` at [ends[r - 1], ends[r]).
+        No text is tokenized: one stable sort groups the entries by term.
+        """
+        index = cls(**params)
+        index.terms = list(terms)
+        index._term_ids = {term: id_ for id_, term in enumerate(index.terms)}
+        counts = np.diff(np.asarray(ends, dtype=np.int64), prepend=0)
+        rows = np.repeat(np.arange(len(counts), dtype=np.uint32), counts)
+        index._set_csr(np.asarray(term_ids, dtype=np.uint32), rows, np.asarray(tfs, dtype=np.uint32))
+        lengths = np.bincount(rows, weights=tfs, minlength=len(counts)).astype(np.uint32)
+        index._lengths = array("I", lengths.tobytes())
+        index._total_length = int(lengths.sum())
+        return index
+
+    def _set_csr(self, term_ids: np.ndarray, rows: np.ndarray, tfs: np.ndarray):
+        """Replaces the CSR postings; entries must be in ascending row order."""
+        # Stable LSD radix sort on 16-bit digits: NumPy radix-sorts 16-bit keys in linear
+        # time, several times faster than a stable sort of the 32-bit ids
+        order = np.argsort(term_ids.astype(np.uint16), kind="stable")
+        if len(self.terms) > 1 << 16:
+            order = order[np.argsort((term_ids[order] >> 16).astype(np.uint16), kind="stable")]
+        self._csr_rows = rows[order]
+        self._csr_tfs = tfs[order]
+        self._ptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.terms)), out=self._ptr[1:])
+        self._rows, self._tfs = {}, {}
+
+    def encode(self, text: str) -> Tuple[List[int], List[int]]:
+        """Term ids and frequencies of one text; unseen terms get the next ids."""
+        counts = Counter(tokenize(text))
+        ids = []
+        for term in counts:
+            id_ = self._term_ids.get(term)
+            if id_ is None:
+                id_ = self._term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            ids.append(id_)
+        return ids, list(counts.values())
+
+    def add_encoded(self, term_ids: List[int], tfs: List[int]):
+        """Indexes one encoded text as the next row."""
+        row = len(self._lengths)
+        for id_, tf in zip(term_ids, tfs):
+            if id_ not in self._rows:
+                self._rows[id_] = array("I")
+                self._tfs[id_] = array("I")
+            self._rows[id_].append(row)
+            self._tfs[id_].append(tf)
+        length = sum(tfs)
+        self._lengths.append(length)
+        self._total_length += length
+
+    def add(self, texts: List[str]):
+        """Indexes texts as the next rows, in order."""
+        for text in texts:
+            self.add_encoded(*self.encode(text))
+
+    def _postings(self, id_: int) -> Tuple[np.ndarray, np.ndarray]:
+        rows, tfs = [], []
+        if id_ + 1 < len(self._ptr):
+            lo, hi = self._ptr[id_], self._ptr[id_ + 1]
+            rows.append(self._csr_rows[lo:hi])
+            tfs.append(self._csr_tfs[lo:hi])
+        if id_ in self._rows:
+            rows.append(np.frombuffer(self._rows[id_], dtype=np.uint32))
+            tfs.append(np.frombuffer(self._tfs[id_], dtype=np.uint32))
+        # concatenate/astype copy, so no view of a growable buffer outlives the query
+        return np.concatenate(rows).astype(np.int64), np.concatenate(tfs).astype(np.float32)
+
+    def compact(self, keep: np.ndarray):
+        """Drops rows where the boolean ``keep`` is False and renumbers the rest in order."""
+        counts = np.diff(self._ptr)
+        term_ids = [np.repeat(np.arange(len(counts), dtype=np.uint32), counts)]
+        rows, tfs = [self._csr_rows], [self._csr_tfs]
+        for id_ in self._rows:
+            tail = np.frombuffer(self._rows[id_], dtype=np.uint32)
+            term_ids.append(np.full(len(tail), id_, dtype=np.uint32))
+            rows.append(tail.copy())
+            tfs.append(np.frombuffer(self._tfs[id_], dtype=np.uint32).copy())
+        term_ids, rows, tfs = np.concatenate(term_ids), np.concatenate(rows), np.concatenate(tfs)
+        kept = keep[rows]
+        renumber = (np.cumsum(keep) - 1).astype(np.uint32)
+        # Stable sort by row first, so each term's rows stay ascending once grouped again
+        order = np.argsort(rows[kept], kind="stable")
+        self._set_csr(term_ids[kept][order], renumber[rows[kept]][order], tfs[kept][order])
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)[keep[:len(self._lengths)]]
+        self._lengths = array("I", lengths.tobytes())
+        self._total_length = int(lengths.sum())
+
+    def search(self, query: str, k: int, exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (rows, scores) of the top-k BM25 matches; rows flagged in ``exclude`` are skipped."""
+        n = len(self._lengths)
+        ids = [self._term_ids[t] for t in set(tokenize(query)) if t in self._term_ids]
+        postings = [p for p in map(self._postings, ids) if len(p[0])]
+        if not n or not postings:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        avgdl = self._total_length / n or 1.0
+        all_rows = np.concatenate([rows for rows, _ in postings])
+        # Fancy indexing copies: the view of _lengths is gone before anything else runs
+        doc_lengths = np.frombuffer(self._lengths, dtype=np.uint32)[all_rows]
+        all_scores, offset = [], 0
+        for rows, tf in postings:
+            idf = np.log1p((n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[offset:offset + len(rows)] / avgdl)
+            all_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+            offset += len(rows)
+        rows, inverse = np.unique(all_rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if exclude is not None:
+            keep = ~exclude[rows]
+            rows, scores = rows[keep], scores[keep]
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]
@@ -0,0 +1,996 @@
+import functools
+import json
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+from array import array
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+from src.ann import IVFIndex, recall_at_k, top_k_indices, top_k_indices_batch
+from src.lexical import BM25Index
+
+# Ids are stored as fixed-width bytes so they can live in a memory-mapped array
+ID_WIDTH = 64
+# Upper bound on the (queries x rows) score matrix built per batch-search step
+MAX_BATCH_SCORES = 1 << 25
+# Rows of quantized codes widened to float32 at a time while scanning
+SCAN_BLOCK = 16384
+QUANTIZATIONS = ("none", "float16", "int8")
+# Metadata fields kept as per-row columns for filter pushdown: categorical
+# fields are dictionary-encoded with a posting list per value, range fields are
+# stored as integers (-1 = missing)
+FILTER_FIELDS = ("source", "loader")
+RANGE_FIELDS = ("page",)
+
+
+def validate_filters(filters: Optional[Dict[str, Any]]):
+    """Raises ValueError for filters that neither the local store nor Endee can apply."""
+    if filters is None:
+        return
+    if not isinstance(filters, dict):
+        raise ValueError("filters must map field names to values")
+    for field, wanted in filters.items():
+        if field in RANGE_FIELDS:
+            bounds = wanted if isinstance(wanted, (list, tuple)) else (wanted, wanted)
+            if len(bounds) != 2 or not all(isinstance(b, (int, float)) and not isinstance(b, bool) for b in bounds):
+                raise ValueError(f"Filter {field!r} takes a number or a [low, high] pair")
+        elif field not in FILTER_FIELDS:
+            raise ValueError(f"Unsupported filter field: {field}")
+
+
+def _locked(method):
+    """Runs a LocalVectorStore method under the store's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class LocalVectorStore:
+    """Growable float32 matrix of unit-normalised vectors with parallel payload arrays.
+
+    Backs EndeeService's offline fallback search and holds the text/metadata
+    for ids returned by the Endee server.
+
+    When ``path`` is given, vectors, ids and payload offsets are raw
+    memory-mapped files and text/metadata go to an append-only segment file.
+    Reopening the directory maps the existing data back in without parsing it;
+    payloads are decoded one record at a time when a result is built.
+
+    ``index="ivf"`` answers searches from an IVF-flat index once the store
+    holds ``min_ann_rows`` rows; ``nprobe`` is the recall/speed knob. The
+    index is retrained when the store has grown ``rebuild_growth`` times
+    past its last training size, or on demand via ``rebuild_index``.
+
+    ``quantization="float16"`` or ``"int8"`` (per-row scale) keeps compact
+    codes that the first search pass scans. With ``rescore`` the best
+    ``k * rescore_factor`` candidates are re-ranked with the float32 rows.
+    Those rows stay on disk (in ``path``, or in an unlinked temporary file
+    for an in-memory store) and only the rescored rows are paged in, so RAM
+    holds the codes alone; the float32 copy costs disk, plus a few random
+    reads per query. Without ``rescore`` an in-memory store keeps no float32
+    copy at all, which also means there is no exact reference to measure
+    recall against. See ``memory_per_chunk`` and ``measure_recall``.
+
+    With ``lexical`` a BM25 inverted index is fed from ``add`` for
+    ``search_lexical``. A persisted store also appends each row's term ids
+    and frequencies to forward files, and reopening rebuilds the postings
+    from those on a background thread; no text is tokenized again. Stores
+    saved before the forward files existed tokenize their payloads once, on
+    the first lexical query.
+
+    One store is shared by every app session, so public methods hold an
+    RLock: growing a memmap swaps the array out from under a reader, and a
+    search must never see rows half-written by a concurrent ``add``.
+
+    Deleted and replaced rows are tombstoned, and scans skip them but still
+    pay for them. Once more than ``compact_ratio`` of the rows are dead,
+    ``compact`` rewrites the store with the live rows only.
+
+    Searches accept ``filters`` such as ``{"source": "a.pdf"}``,
+    ``{"loader": ["pdf", "web"]}`` or ``{"page": (3, 10)}`` (inclusive).
+    Categorical values are resolved through per-value posting lists into
+    candidate rows, range bounds are checked on those candidates only, and
+    only the matching rows are scored. The columns are persisted; posting
+    lists are rebuilt from them on the first filtered query after reopening.
+    """
+
+    def __init__(self, dimension: int, path: Optional[str] = None, initial_capacity: int = 1024,
+                 index: str = "flat", nprobe: int = 8, min_ann_rows: int = 10_000,
+                 rebuild_growth: float = 2.0, quantization: str = "none", rescore: bool = True,
+                 rescore_factor: int = 4, lexical: bool = True, compact_ratio: Optional[float] = 0.25):
+        if index not in ("flat", "ivf"):
+            raise ValueError(f"Unknown index type: {index}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.dimension = dimension
+        self.path = path
+        self.quantization = quantization
+        self.rescore = rescore and quantization != "none"
+        self.rescore_factor = rescore_factor
+        # Full-precision rows are needed unquantized, for rescoring, or kept on disk anyway
+        self._keep_full = quantization == "none" or rescore or path is not None
+        # In memory, rescoring rows go to a temporary file instead of RAM. TemporaryFile
+        # has no directory entry, so even a killed process leaves nothing behind
+        self._spill_file = None
+        self._full_fd = None
+        self._full_fd_closer = None
+        if self.rescore and path is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="lumina-vectors-")
+        self.min_ann_rows = min_ann_rows
+        self.rebuild_growth = rebuild_growth
+        self.compact_ratio = compact_ratio
+        # Trained lazily, so reopening a persisted store stays cheap
+        self._ann = IVFIndex(dimension, nprobe=nprobe) if index == "ivf" else None
+        self.lexical = lexical
+        self._lexical = BM25Index() if lexical else None
+        # Rows whose forward entries are persisted, and the thread rebuilding postings from them
+        self._lexical_rows = 0
+        self._lexical_loader: Optional[threading.Thread] = None
+        # Dictionary encoding of FILTER_FIELDS values; codes index into the field columns
+        self._vocab: Dict[str, Dict[str, int]] = {field: {} for field in FILTER_FIELDS}
+        self._vocab_dirty = False
+        # field -> value code -> ascending rows holding it; built lazily from the columns
+        self._postings: Optional[Dict[str, Dict[int, array]]] = None
+        self._size = 0
+        self._n_deleted = 0
+        # Parallel payload arrays for the in-memory mode
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        # Built lazily after reopening a persisted store
+        self._row_by_id: Optional[Dict[str, int]] = {}
+        self._segment_file = None
+        self._segment_map = None
+        # Hydration runs on several threads; the mapping is only swapped under this lock
+        self._segment_lock = threading.Lock()
+        self._lock = threading.RLock()
+
+        capacity = initial_capacity
+        rebuild_columns = False
+        if path:
+            os.makedirs(path, exist_ok=True)
+            if os.path.exists(self._file("meta.json.compact")):
+                # A compaction reached its commit point; finish moving its files in
+                self._finish_compaction()
+            for name in os.listdir(path):
+                if name.endswith(".compact"):
+                    # Left by a compaction interrupted before its commit point
+                    os.remove(self._file(name))
+            meta = self._read_meta()
+            if not meta:
+                # Written on the first commit, so a reopened store knows its columns are complete
+                self._vocab_dirty = True
+            if meta:
+                if meta["dimension"] != dimension:
+                    raise ValueError(
+                        f"Store at {path} has dimension {meta['dimension']}, expected {dimension}"
+                    )
+                if meta.get("quantization", "none") != quantization:
+                    raise ValueError(
+                        f"Store at {path} uses quantization {meta.get('quantization', 'none')!r}, "
+                        f"expected {quantization!r}"
+                    )
+                self._size = meta["count"]
+                self._lexical_rows = meta.get("lexical_rows", 0)
+                self._row_by_id = None
+                columns = [self._file("fields.json")] + [
+                    self._file(f"{field}.i32") for field in FILTER_FIELDS + RANGE_FIELDS
+                ]
+                if all(os.path.exists(file) for file in columns):
+                    with open(self._file("fields.json")) as f:
+                        self._vocab.update(json.load(f))
+                else:
+                    # Saved before filter columns existed: they would open zero-filled
+                    rebuild_columns = self._size > 0
+                    self._vocab_dirty = True
+                capacity = max(capacity, self._size)
+        self._open_arrays(capacity)
+        if path:
+            self._truncate_segment()
+            self._n_deleted = int(np.count_nonzero(self._deleted[:self._size]))
+            if rebuild_columns:
+                self._rebuild_columns()
+            if self.lexical:
+                self._truncate_lexical()
+                if self._lexical_rows:
+                    self._lexical_loader = threading.Thread(target=self._load_lexical, name="lexical-load",
+                                                            daemon=True)
+                    self._lexical_loader.start()
+
+    def __len__(self) -> int:
+        return self._size - self._n_deleted
+
+    # --- storage layout -------------------------------------------------
+
+    def _layout(self) -> Dict[str, Tuple[str, Any, tuple]]:
+        layout = {}
+        if self._keep_full:
+            layout["_vectors"] = ("vectors.f32", np.float32, (self.dimension,))
+        if self.quantization == "float16":
+            layout["_codes"] = ("codes.f16", np.float16, (self.dimension,))
+        elif self.quantization == "int8":
+            layout["_codes"] = ("codes.i8", np.int8, (self.dimension,))
+            layout["_scales"] = ("scales.f32", np.float32, ())
+        layout.update({
+            "_ids": ("ids.bin", f"S{ID_WIDTH}", ()),
+            # Tombstones; deleted rows keep their slot but are never returned
+            "_deleted": ("deleted.u8", np.bool_, ()),
+        })
+        for field in FILTER_FIELDS + RANGE_FIELDS:
+            layout[f"_col_{field}"] = (f"{field}.i32", np.int32, ())
+        if self.path:
+            # (start, length) of each row's record in payloads.seg
+            layout["_offsets"] = ("offsets.i64", np.int64, (2,))
+            if self.lexical:
+                # End of each row's entries in the lexical.terms/lexical.tfs forward files
+                layout["_lex_ends"] = ("lexical.ends.i64", np.int64, ())
+        return layout
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _spilled(self, name: str) -> bool:
+        return self._spill_file is not None and name == "vectors.f32"
+
+    @staticmethod
+    def _row_bytes(dtype, row_shape: tuple) -> int:
+        return int(np.prod(row_shape)) * np.dtype(dtype).itemsize
+
+    def _open_array(self, name: str, dtype, row_shape: tuple, capacity: int) -> np.ndarray:
+        shape = (capacity,) + row_shape
+        if not self.path and not self._spilled(name):
+            return np.zeros(shape, dtype=dtype)
+        row_bytes = self._row_bytes(dtype, row_shape)
+        if self._spilled(name):
+            # Only ever grows; the file object stays open for the store's lifetime
+            self._spill_file.truncate(capacity * row_bytes)
+            return np.memmap(self._spill_file, dtype=dtype, mode="r+", shape=shape)
+        file = self._file(name)
+        with open(file, "ab") as f:
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+            else:
+                # Keep any extra capacity already on disk
+                shape = (f.tell() // row_bytes,) + row_shape
+        return np.memmap(file, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_arrays(self, capacity: int):
+        layout = self._layout()
+        if self.path:
+            # Files added by a later version (e.g. filter columns) would otherwise open
+            # smaller than the ones already on disk; give every array the same capacity
+            for name, dtype, row_shape in layout.values():
+                if os.path.exists(self._file(name)):
+                    capacity = max(capacity, os.path.getsize(self._file(name)) // self._row_bytes(dtype, row_shape))
+        for attr, (name, dtype, row_shape) in layout.items():
+            setattr(self, attr, self._open_array(name, dtype, row_shape, capacity))
+
+    def _reserve(self, extra: int):
+        needed = self._size + extra
+        for attr, (name, dtype, row_shape) in self._layout().items():
+            old = getattr(self, attr)
+            # Checked per array: capacities can differ, e.g. after an interrupted grow
+            if needed <= old.shape[0]:
+                continue
+            new_capacity = max(needed, old.shape[0] * 2)
+            if isinstance(old, np.memmap):
+                # Release the old mapping before the file is extended
+                old.flush()
+                setattr(self, attr, None)
+                del old
+                setattr(self, attr, self._open_array(name, dtype, row_shape, new_capacity))
+            else:
+                grown = np.zeros((new_capacity,) + row_shape, dtype=dtype)
+                grown[:self._size] = old[:self._size]
+                setattr(self, attr, grown)
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self._file("meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _commit(self):
+        """Flushes the mapped arrays, then publishes the new row count."""
+        if not self.path:
+            return
+        for attr in self._layout():
+            getattr(self, attr).flush()
+        if self._vocab_dirty:
+            with open(self._file("fields.json"), "w") as f:
+                json.dump(self._vocab, f)
+            self._vocab_dirty = False
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._meta(), f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _meta(self) -> dict:
+        return {"dimension": self.dimension, "count": self._size, "quantization": self.quantization,
+                "lexical_rows": self._lexical_rows}
+
+    # --- payload segment ------------------------------------------------
+
+    def _close_segment(self):
+        with self._segment_lock:
+            self._release_segment()
+
+    def _release_segment(self):
+        if self._segment_map is not None:
+            self._segment_map.close()
+            self._segment_map = None
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
+
+    def _truncate_segment(self):
+        """Drops bytes past the last committed record, e.g. from an interrupted append."""
+        end = int(self._offsets[self._size - 1].sum()) if self._size else 0
+        with open(self._file("payloads.seg"), "ab") as f:
+            if f.tell() != end:
+                f.truncate(end)
+
+    def _append_payloads(self, start: int, texts: List[str], metadatas: List[dict]):
+        if not self.path:
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+            return
+        records = [
+            (json.dumps({"text": text, "metadata": meta}, default=str) + "\n").encode("utf-8")
+            for text, meta in zip(texts, metadatas)
+        ]
+        lengths = np.fromiter((len(r) for r in records), dtype=np.int64, count=len(records))
+        with open(self._file("payloads.seg"), "ab") as f:
+            base = f.tell()
+            f.write(b"".join(records))
+        rows = slice(start, start + len(records))
+        self._offsets[rows, 0] = base + np.cumsum(lengths) - lengths
+        self._offsets[rows, 1] = lengths
+
+    def _payload(self, row: int) -> Tuple[str, dict]:
+        if not self.path:
+            return self._texts[row], self._metadatas[row]
+        start, length = (int(x) for x in self._offsets[row])
+        end = start + length
+        with self._segment_lock:
+            # Remapped when the segment has grown past the current mapping
+            if self._segment_map is None or end > len(self._segment_map):
+                self._release_segment()
+                self._segment_file = open(self._file("payloads.seg"), "rb")
+                self._segment_map = mmap.mmap(self._segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            # Slicing copies, so the record outlives a later remap
+            data = self._segment_map[start:end]
+        record = json.loads(data)
+        return record["text"], record["metadata"]
+
+    # --- lexical forward files ------------------------------------------
+
+    def _truncate_lexical(self):
+        """Drops forward entries past the last committed row; without rows the vocabulary restarts too."""
+        end = int(self._lex_ends[self._lexical_rows - 1]) if self._lexical_rows else 0
+        for name in ("lexical.terms.u32", "lexical.tfs.u32"):
+            with open(self._file(name), "ab") as f:
+                if f.tell() != end * 4:
+                    f.truncate(end * 4)
+        with open(self._file("lexical.vocab"), "ab") as f:
+            if not self._lexical_rows:
+                f.truncate(0)
+
+    def _load_lexical(self):
+        """Rebuilds the BM25 postings from the forward files; runs on a thread started at open."""
+        n = self._lexical_rows
+        try:
+            with open(self._file("lexical.vocab"), "rb") as f:
+                vocab = f.read()
+            if not vocab.endswith(b"\n"):
+                # A term line cut short by an interrupted add; drop it so later ids line up
+                with open(self._file("lexical.vocab"), "ab") as f:
+                    f.truncate(vocab.rfind(b"\n") + 1)
+            terms = vocab.decode("utf-8").split("\n")[:-1]
+            ends = np.fromfile(self._file("lexical.ends.i64"), dtype=np.int64, count=n)
+            entries = int(ends[-1])
+            term_ids = np.fromfile(self._file("lexical.terms.u32"), dtype=np.uint32, count=entries)
+            tfs = np.fromfile(self._file("lexical.tfs.u32"), dtype=np.uint32, count=entries)
+            self._lexical = BM25Index.from_entries(terms, ends, term_ids, tfs)
+        except Exception as e:
+            print(f"Could not load the BM25 index in {self.path}, re-indexing from payloads: {e}")
+            self._lexical = BM25Index()
+            self._lexical_rows = 0
+            self._truncate_lexical()
+
+    def _await_lexical(self):
+        """Waits for the postings rebuilt at open; everything touching self._lexical calls this first."""
+        if self._lexical_loader is not None:
+            self._lexical_loader.join()
+            self._lexical_loader = None
+
+    def _index_texts(self, start: int, texts: List[str]):
+        """Adds rows ``start``.. to the BM25 index and, when persisted, to the forward files."""
+        if not self.path:
+            self._lexical.add(texts)
+            self._lexical_rows = start + len(texts)
+            return
+        known = len(self._lexical.terms)
+        encoded = [self._lexical.encode(text) for text in texts]
+        counts = np.fromiter((len(ids) for ids, _ in encoded), dtype=np.int64, count=len(encoded))
+        base = int(self._lex_ends[start - 1]) if start else 0
+        new_terms = self._lexical.terms[known:]
+        if new_terms:
+            with open(self._file("lexical.vocab"), "ab") as f:
+                f.write(("\n".join(new_terms) + "\n").encode("utf-8"))
+        for name, column in (("lexical.terms.u32", 0), ("lexical.tfs.u32", 1)):
+            values = [value for pair in encoded for value in pair[column]]
+            with open(self._file(name), "ab") as f:
+                # Anything past the last committed row is left over from an interrupted add
+                f.truncate(base * 4)
+                f.write(np.asarray(values, dtype=np.uint32).tobytes())
+        self._lex_ends[start:start + len(texts)] = base + np.cumsum(counts)
+        for ids, tfs in encoded:
+            self._lexical.add_encoded(ids, tfs)
+        self._lexical_rows = start + len(texts)
+
+    # --- public API -----------------------------------------------------
+
+    def _id_index(self) -> Dict[str, int]:
+        if self._row_by_id is None:
+            ids = self._ids[:self._size].tolist()
+            deleted = self._deleted[:self._size]
+            self._row_by_id = {id_.decode("utf-8"): row for row, id_ in enumerate(ids) if not deleted[row]}
+        return self._row_by_id
+
+    @_locked
+    def add(self, ids: List[str], vectors: List[List[float]], texts: List[str], metadatas: List[dict]):
+        """Appends rows; an id that is already stored is replaced (its old row is tombstoned)."""
+        vecs = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        n = vecs.shape[0]
+        if n == 0:
+            return
+        encoded = [id_.encode("utf-8") for id_ in ids]
+        if any(len(id_) > ID_WIDTH for id_ in encoded):
+            raise ValueError(f"Document ids must be at most {ID_WIDTH} bytes")
+        self._tombstone([row for row in map(self._id_index().get, ids) if row is not None])
+        self._reserve(n)
+        norms = np.linalg.norm(vecs, axis=1)
+        safe = np.where(norms > 0, norms, 1.0)
+        start = self._size
+        unit = vecs / safe[:, None]
+        if self._keep_full:
+            self._write_full(start, unit)
+        if self.quantization == "float16":
+            self._codes[start:start + n] = unit
+        elif self.quantization == "int8":
+            scales = np.abs(unit).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._codes[start:start + n] = np.rint(unit / scales[:, None])
+            self._scales[start:start + n] = scales
+        self._ids[start:start + n] = encoded
+        self._deleted[start:start + n] = False
+        self._write_columns(start, metadatas)
+        self._append_payloads(start, texts, metadatas)
+        if self.lexical:
+            self._await_lexical()
+            if len(self._lexical) == start:
+                self._index_texts(start, texts)
+        for offset, id_ in enumerate(ids):
+            self._row_by_id[id_] = start + offset
+        self._size += n
+        self._commit()
+        if self._ann is not None and self._ann.is_trained:
+            if self._size >= self.rebuild_growth * self._ann.trained_size:
+                self.rebuild_index()
+            else:
+                self._ann.add(np.arange(start, self._size), self._full(slice(start, self._size)))
+        self._maybe_compact()
+
+    def _write_full(self, start: int, unit: np.ndarray):
+        if self.quantization == "none" or not isinstance(self._vectors, np.memmap):
+            self._vectors[start:start + unit.shape[0]] = unit
+            return
+        # Rescoring-only rows: written through the file so they never fault into this
+        # process's mapping; searches page in just the candidates they rescore
+        if self._spill_file is not None:
+            self._full_fd = self._spill_file.fileno()
+        elif self._full_fd is None:
+            self._full_fd = os.open(self._vectors.filename, os.O_RDWR)
+            self._full_fd_closer = weakref.finalize(self, os.close, self._full_fd)
+        os.pwrite(self._full_fd, np.ascontiguousarray(unit, dtype=np.float32).tobytes(),
+                  start * unit.shape[1] * 4)
+
+    def _close_full_fd(self):
+        if self._full_fd_closer is not None:
+            self._full_fd_closer()
+            self._full_fd_closer = None
+        self._full_fd = None
+
+    def _rebuild_columns(self):
+        """Backfills the filter columns from the payload segment."""
+        for start in range(0, self._size, 1024):
+            rows = range(start, min(start + 1024, self._size))
+            self._write_columns(start, [self._payload(row)[1] for row in rows])
+        self._commit()
+
+    def _write_columns(self, start: int, metadatas: List[dict]):
+        rows = slice(start, start + len(metadatas))
+        for field in FILTER_FIELDS:
+            vocab = self._vocab[field]
+            codes = []
+            for meta in metadatas:
+                if field not in meta:
+                    codes.append(-1)
+                    continue
+                value = str(meta[field])
+                if value not in vocab:
+                    vocab[value] = len(vocab)
+                    self._vocab_dirty = True
+                codes.append(vocab[value])
+            getattr(self, f"_col_{field}")[rows] = codes
+            if self._postings is not None:
+                postings = self._postings[field]
+                for row, code in enumerate(codes, start):
+                    if code >= 0:
+                        postings.setdefault(code, array("I")).append(row)
+        for field in RANGE_FIELDS:
+            values = []
+            for meta in metadatas:
+                try:
+                    values.append(int(meta[field]))
+                except (KeyError, TypeError, ValueError):
+                    values.append(-1)
+            getattr(self, f"_col_{field}")[rows] = values
+
+    @_locked
+    def field_values(self, field: str) -> List[str]:
+        """Distinct values seen for a categorical filter field."""
+        return sorted(self._vocab.get(field, {}))
+
+    def _posting_lists(self) -> Dict[str, Dict[int, array]]:
+        if self._postings is None:
+            postings = {}
+            for field in FILTER_FIELDS:
+                column = getattr(self, f"_col_{field}")[:self._size]
+                order = np.argsort(column, kind="stable").astype(np.uint32)
+                codes, starts = np.unique(column[order], return_index=True)
+                lists = postings[field] = {}
+                for code, rows in zip(codes.tolist(), np.split(order, starts[1:])):
+                    if code >= 0:
+                        lists[code] = array("I", rows.tobytes())
+            self._postings = postings
+        return self._postings
+
+    def _candidates(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Ascending live rows matching every filter, or None when there are no filters.
+
+        Categorical fields union the posting lists of their values and intersect
+        across fields, so the work follows the number of matches, not the store size.
+        """
+        if not filters:
+            return None
+        validate_filters(filters)
+        cand = None
+        for field, wanted in filters.items():
+            if field in FILTER_FIELDS:
+                values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+                lists = self._posting_lists()[field]
+                codes = {self._vocab[field][str(v)] for v in values if str(v) in self._vocab[field]}
+                # astype copies, so no buffer export outlives the query (add() must be able to grow)
+                parts = [
+                    np.frombuffer(lists[code], dtype=np.uint32).astype(np.int64) for code in codes if code in lists
+                ]
+                rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+                cand = rows if cand is None else np.intersect1d(cand, rows, assume_unique=True)
+        if cand is None:
+            cand = np.arange(self._size)
+        for field in RANGE_FIELDS:
+            if field in filters:
+                wanted = filters[field]
+                low, high = wanted if isinstance(wanted, (list, tuple)) else (wanted, wanted)
+                column = getattr(self, f"_col_{field}")[cand]
+                cand = cand[(column >= low) & (column <= high)]
+        if self._n_deleted:
+            cand = cand[~self._deleted[cand]]
+        return cand
+
+    def _tombstone(self, rows: List[int]):
+        rows = [row for row in rows if not self._deleted[row]]
+        if rows:
+            self._deleted[rows] = True
+            self._n_deleted += len(rows)
+
+    @_locked
+    def delete(self, ids: List[str]) -> int:
+        """Tombstones the rows for ``ids``; returns how many were found."""
+        index = self._id_index()
+        rows = [index.pop(id_) for id_ in ids if id_ in index]
+        self._tombstone(rows)
+        self._commit()
+        self._maybe_compact()
+        return len(rows)
+
+    @_locked
+    def result(self, row: int, score: float) -> Dict[str, Any]:
+        """Builds a fresh result dict for a row; stored payloads are never mutated."""
+        text, metadata = self._payload(row)
+        return {
+            "id": self._ids[row].decode("utf-8"),
+            "text": text,
+            "metadata": dict(metadata),
+            "score": float(score),
+        }
+
+    @_locked
+    def row_of(self, id_: str) -> Optional[int]:
+        return self._id_index().get(id_)
+
+    @_locked
+    def hydrate(self, ids: List[str], scores: List[float],
+                payloads: Optional[List[Optional[dict]]] = None) -> List[Dict]:
+        """Resolves (id, score) hits from the server into result dicts.
+
+        Ids unknown locally are built from ``payloads`` (the server-side meta,
+        text under "text") when given, and dropped otherwise.
+        """
+        lookup = self._id_index().get
+        results = []
+        for i, (id_, score) in enumerate(zip(ids, scores)):
+            row = lookup(id_)
+            if row is not None:
+                results.append(self.result(row, score))
+            elif payloads and payloads[i] and "text" in payloads[i]:
+                metadata = {k: v for k, v in payloads[i].items() if k != "text"}
+                results.append({"id": id_, "text": payloads[i]["text"], "metadata": metadata, "score": float(score)})
+        return results
+
+    # --- scoring --------------------------------------------------------
+
+    def _full(self, rows) -> np.ndarray:
+        """float32 unit rows for the ANN index; quantized stores dequantize their codes.
+
+        Reading the float32 copy here would page all of it in, which is what
+        keeping it on disk avoids.
+        """
+        if self.quantization == "none":
+            return self._vectors[rows]
+        block = self._codes[rows].astype(np.float32)
+        if self.quantization == "int8":
+            block *= self._scales[rows][..., None]
+        return block
+
+    def _scores(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        """First-pass (queries x rows) similarities; ``rows`` defaults to every stored row."""
+        if rows is None:
+            rows = slice(0, self._size)
+        if self.quantization == "none":
+            return queries @ self._vectors[rows].T
+        if isinstance(rows, slice):
+            blocks = [slice(i, min(i + SCAN_BLOCK, rows.stop)) for i in range(rows.start, rows.stop, SCAN_BLOCK)]
+            n = rows.stop - rows.start
+        else:
+            blocks = [rows[i:i + SCAN_BLOCK] for i in range(0, len(rows), SCAN_BLOCK)]
+            n = len(rows)
+        out = np.empty((queries.shape[0], n), dtype=np.float32)
+        col = 0
+        # Widen the codes block by block so the scan never materialises a float32 copy
+        for block in blocks:
+            part = queries @ self._codes[block].astype(np.float32).T
+            if self.quantization == "int8":
+                part *= self._scales[block]
+            out[:, col:col + part.shape[1]] = part
+            col += part.shape[1]
+        return out
+
+    def _rescored(self, rows: np.ndarray, q: np.ndarray, k: int):
+        """Re-ranks first-pass candidates with exact float32 dot products."""
+        exact = self._vectors[rows] @ q
+        top = top_k_indices(exact, k)
+        return rows[top], exact[top]
+
+    @_locked
+    def rebuild_index(self):
+        """Retrains the ANN index from scratch on the current rows."""
+        if self._ann is not None:
+            self._ann.build(self._full(slice(0, self._size)))
+
+    def _ann_ready(self) -> bool:
+        if self._ann is None or self._size < self.min_ann_rows:
+            return False
+        if not self._ann.is_trained:
+            self.rebuild_index()
+        return True
+
+    def _search_rows(self, q: np.ndarray, k: int, exact: bool = False, nprobe: Optional[int] = None,
+                     candidates: Optional[np.ndarray] = None):
+        """Top-k (rows, scores) for a unit query.
+
+        ``exact`` forces a full-precision flat scan, the reference for measure_recall.
+        ``candidates`` (from _candidates) restricts scoring to those rows.
+        """
+        if exact and not self._keep_full:
+            raise ValueError("No float32 copy is kept (quantized, rescore=False, in memory); nothing is exact")
+        deleted = self._deleted[:self._size] if self._n_deleted else None
+        fetch = k * self.rescore_factor if self.rescore and not exact else k
+        if candidates is not None:
+            cand = candidates
+            sims = self._vectors[cand] @ q if exact else self._scores(q[None], cand)[0]
+            top = top_k_indices(sims, fetch)
+            rows, sims = cand[top], sims[top]
+        elif not exact and self._ann_ready():
+            rows, sims = self._ann.search(lambda r, v: self._scores(v[None], r)[0], q, fetch, nprobe,
+                                          deleted=deleted)
+        else:
+            if exact:
+                sims = self._vectors[:self._size] @ q
+            else:
+                sims = self._scores(q[None])[0]
+            if deleted is not None:
+                sims[deleted] = -np.inf
+            rows = top_k_indices(sims, fetch)
+            rows = rows[np.isfinite(sims[rows])]
+            sims = sims[rows]
+        if fetch > k:
+            return self._rescored(rows, q, k)
+        return rows, sims
+
+    @_locked
+    def search(self, query_vector: List[float], k: int = 4, nprobe: Optional[int] = None,
+               filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        if len(self) == 0 or k <= 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm_q = np.linalg.norm(q)
+        if norm_q == 0:
+            return []
+        rows, sims = self._search_rows(q / norm_q, k, nprobe=nprobe, candidates=self._candidates(filters))
+        return [self.result(row, score) for row, score in zip(rows, sims)]
+
+    @_locked
+    def search_batch(self, query_vectors: List[List[float]], k: int = 4, nprobe: Optional[int] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> List[List[Dict]]:
+        """Searches many queries at once; returns one result list per query, in input order."""
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dimension)
+        out: List[List[Dict]] = [[] for _ in range(queries.shape[0])]
+        if len(self) == 0 or k <= 0:
+            return out
+        norms = np.linalg.norm(queries, axis=1)
+        valid = np.flatnonzero(norms > 0)
+        queries = queries[valid] / norms[valid, None]
+
+        cand = self._candidates(filters)
+        if cand is None and self._ann_ready():
+            # IVF candidate lists differ per query, so there is no shared matrix product
+            for i, q in zip(valid, queries):
+                rows, sims = self._search_rows(q, k, nprobe=nprobe)
+                out[i] = [self.result(row, score) for row, score in zip(rows, sims)]
+            return out
+
+        n = self._size if cand is None else cand.shape[0]
+        if n == 0:
+            return out
+        step = max(1, MAX_BATCH_SCORES // n)
+        for start in range(0, len(valid), step):
+            sims = self._scores(queries[start:start + step], cand)
+            if cand is None and self._n_deleted:
+                sims[:, self._deleted[:self._size]] = -np.inf
+            top = top_k_indices_batch(sims, k * self.rescore_factor if self.rescore else k)
+            scores = np.take_along_axis(sims, top, axis=1)
+            if cand is not None:
+                top = cand[top]
+            for i, q, rows, row_scores in zip(valid[start:start + step], queries[start:start + step], top, scores):
+                rows, row_scores = rows[np.isfinite(row_scores)], row_scores[np.isfinite(row_scores)]
+                if self.rescore:
+                    rows, row_scores = self._rescored(rows, q, k)
+                out[i] = [self.result(row, score) for row, score in zip(rows, row_scores)]
+        return out
+
+    def _lexical_ready(self) -> bool:
+        # Called under the store lock, so concurrent first queries catch up only once
+        if not self.lexical:
+            return False
+        self._await_lexical()
+        caught_up = len(self._lexical)
+        # Only rows the forward files don't cover: a store saved before they existed
+        for start in range(caught_up, self._size, 1024):
+            rows = range(start, min(start + 1024, self._size))
+            self._index_texts(start, [self._payload(row)[0] for row in rows])
+        if caught_up < self._size:
+            self._commit()
+        return True
+
+    @_locked
+    def search_lexical(self, query_text: str, k: int = 4,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        """BM25 keyword search; only the posting lists of the query's terms are scored."""
+        if len(self) == 0 or k <= 0 or not self._lexical_ready():
+            return []
+        cand = self._candidates(filters)
+        if cand is not None:
+            exclude = np.ones(self._size, dtype=bool)
+            exclude[cand] = False
+        else:
+            exclude = self._deleted[:self._size] if self._n_deleted else None
+        rows, scores = self._lexical.search(query_text, k, exclude=exclude)
+        return [self.result(row, score) for row, score in zip(rows, scores)]
+
+    @_locked
+    def measure_recall(self, k: int = 10, n_queries: int = 100, nprobe: Optional[int] = None,
+                       queries: Optional[np.ndarray] = None, seed: int = 0) -> float:
+        """recall@k of the configured index against the exact float32 scan.
+
+        Defaults to stored rows with small Gaussian noise as queries. Raises
+        ValueError when the store keeps no float32 copy to compare against;
+        build the same data with ``rescore=True`` to measure that tradeoff.
+        """
+        if not self._keep_full:
+            raise ValueError("measure_recall needs the float32 rows; this store drops them (rescore=False)")
+        if len(self) == 0:
+            return 1.0
+        if queries is None:
+            rng = np.random.default_rng(seed)
+            live = np.flatnonzero(~self._deleted[:self._size])
+            rows = rng.choice(live, size=min(n_queries, live.shape[0]), replace=False)
+            queries = self._full(rows) + rng.normal(0, 0.05, (len(rows), self.dimension)).astype(np.float32)
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        exact = [self._search_rows(q, k, exact=True)[0].tolist() for q in queries]
+        approx = [self._search_rows(q, k, nprobe=nprobe)[0].tolist() for q in queries]
+        return recall_at_k(exact, approx)
+
+    def memory_per_chunk(self) -> Dict[str, int]:
+        """Bytes per stored chunk for each array, plus derived footprints.
+
+        ``scan`` is what the first pass reads, ``total`` everything stored and
+        ``resident`` what searching keeps paged in: with quantization the
+        float32 rows are only read for rescored candidates, so they are left
+        out. Payload text/metadata are excluded; they are the same in every mode.
+        """
+        sizes = {}
+        for attr, (name, dtype, row_shape) in self._layout().items():
+            sizes[name] = self._row_bytes(dtype, row_shape)
+        sizes["scan"] = sizes.get("codes.f16", 0) + sizes.get("codes.i8", 0) + sizes.get("scales.f32", 0) \
+            or sizes["vectors.f32"]
+        sizes["total"] = sum(v for k, v in sizes.items() if k != "scan")
+        sizes["resident"] = sizes["total"] - (sizes.get("vectors.f32", 0) if self.quantization != "none" else 0)
+        return sizes
+
+    # --- compaction -----------------------------------------------------
+
+    def _maybe_compact(self):
+        if self.compact_ratio is not None and self._n_deleted > self.compact_ratio * self._size:
+            self.compact()
+
+    @_locked
+    def compact(self):
+        """Rewrites the store without its tombstoned rows, so scans and disk follow the live rows.
+
+        Row numbers change (ids don't): the ANN index retrains and filter
+        posting lists rebuild on next use. A persisted store writes the
+        compacted copy as ``*.compact`` files and swaps it in after
+        ``meta.json.compact`` is written; an interrupted compaction is
+        finished or discarded when the store is next opened.
+        """
+        if not self._n_deleted:
+            return
+        if self.lexical:
+            # Renumbering needs every row in the BM25 index and its forward entries
+            self._lexical_ready()
+        keep = ~self._deleted[:self._size]
+        live = np.flatnonzero(keep)
+        if self.path:
+            self._write_compacted(live, keep)
+        else:
+            self._compact_in_place(live, keep)
+        self._size = live.shape[0]
+        self._n_deleted = 0
+        self._row_by_id = None
+        self._postings = None
+        if self._ann is not None:
+            self._ann.reset()
+        if self.lexical:
+            self._lexical.compact(keep)
+            self._lexical_rows = self._size
+        else:
+            # Forward entries left by a lexical open no longer match the row numbers
+            self._lexical_rows = 0
+        if self.path:
+            capacity = self._ids.shape[0]
+            with open(self._file("meta.json.compact"), "w") as f:
+                json.dump(self._meta(), f)
+            self._close_segment()
+            self._close_full_fd()
+            for attr in self._layout():
+                setattr(self, attr, None)
+            self._finish_compaction()
+            self._open_arrays(capacity)
+
+    def _compact_in_place(self, live: np.ndarray, keep: np.ndarray):
+        for attr in self._layout():
+            array_ = getattr(self, attr)
+            # Rows only move down (live[i] >= i), so ascending blocks never read an overwritten row
+            for start in range(0, live.shape[0], SCAN_BLOCK):
+                block = live[start:start + SCAN_BLOCK]
+                array_[start:start + block.shape[0]] = array_[block]
+        self._texts = [text for text, kept in zip(self._texts, keep) if kept]
+        self._metadatas = [meta for meta, kept in zip(self._metadatas, keep) if kept]
+
+    def _write_compacted(self, live: np.ndarray, keep: np.ndarray):
+        """Writes the live rows to ``*.compact`` files next to the current ones."""
+        def compacted(name: str) -> str:
+            return self._file(name + ".compact")
+
+        for attr, (name, dtype, row_shape) in self._layout().items():
+            if attr in ("_offsets", "_lex_ends"):
+                continue
+            old = getattr(self, attr)
+            new = np.memmap(compacted(name), dtype=dtype, mode="w+", shape=old.shape)
+            for start in range(0, live.shape[0], SCAN_BLOCK):
+                block = live[start:start + SCAN_BLOCK]
+                new[start:start + block.shape[0]] = old[block]
+            new.flush()
+            del new
+
+        offsets = np.memmap(compacted("offsets.i64"), dtype=np.int64, mode="w+", shape=self._offsets.shape)
+        with open(self._file("payloads.seg"), "rb") as src, open(compacted("payloads.seg"), "wb") as dst:
+            segment = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+            position = 0
+            for start in range(0, live.shape[0], 1024):
+                spans = self._offsets[live[start:start + 1024]]
+                dst.write(b"".join(segment[begin:begin + length] for begin, length in spans.tolist()))
+                rows = slice(start, start + spans.shape[0])
+                offsets[rows, 0] = position + np.cumsum(spans[:, 1]) - spans[:, 1]
+                offsets[rows, 1] = spans[:, 1]
+                position += int(spans[:, 1].sum())
+            segment.close()
+        offsets.flush()
+        del offsets
+
+        if self.lexical:
+            ends = np.array(self._lex_ends[:self._size])
+            counts = np.diff(ends, prepend=0)
+            entries = np.repeat(keep, counts)
+            for name in ("lexical.terms.u32", "lexical.tfs.u32"):
+                values = np.fromfile(self._file(name), dtype=np.uint32, count=int(ends[-1]))
+                values[entries].tofile(compacted(name))
+            new_ends = np.memmap(compacted("lexical.ends.i64"), dtype=np.int64, mode="w+",
+                                 shape=self._lex_ends.shape)
+            new_ends[:live.shape[0]] = np.cumsum(counts[keep])
+            new_ends.flush()
+            del new_ends
+
+    def _finish_compaction(self):
+        """Moves the ``*.compact`` files over the originals, meta.json last; safe to repeat."""
+        for name in os.listdir(self.path):
+            if name.endswith(".compact") and name != "meta.json.compact":
+                os.replace(self._file(name), self._file(name[:-len(".compact")]))
+        os.replace(self._file("meta.json.compact"), self._file("meta.json"))
+
+    @_locked
+    def clear(self):
+        # Rows past _size are never read, so the buffers can be reused as is
+        self._size = 0
+        self._n_deleted = 0
+        self._vocab = {field: {} for field in FILTER_FIELDS}
+        self._vocab_dirty = True
+        self._postings = None
+        self._texts, self._metadatas = [], []
+        self._row_by_id = {}
+        if self._ann is not None:
+            self._ann.reset()
+        if self.lexical:
+            self._await_lexical()
+            self._lexical = BM25Index()
+            self._lexical_rows = 0
+        if self.path:
+            self._close_segment()
+            self._truncate_segment()
+            if self.lexical:
+                self._truncate_lexical()
+            self._commit()
+
+    @_locked
+    def close(self):
+        self._commit()
+        self._close_segment()
@@ -0,0 +1,172 @@
+import bisect
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Upper bounds in seconds, from sub-millisecond lookups to slow LLM completions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Fixed-bucket histogram; quantiles are interpolated within buckets like Prometheus does."""
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: dict):
+        self.metrics, self.name, self.labels = metrics, name, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe("stage_seconds", time.perf_counter() - self.started, stage=self.name, **self.labels)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """Process-wide timing histograms and counters for the ingest and query paths.
+
+    ``span(stage)`` times a block into the ``stage_seconds`` histogram and
+    ``inc(name)`` bumps a counter. When disabled both return immediately, so
+    instrumentation can stay in hot paths.
+    """
+
+    def __init__(self, enabled: bool = True, prefix: str = "lumina", buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+
+    def span(self, stage: str, **labels):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            family = self._histograms.setdefault(name, {})
+            if key not in family:
+                family[key] = Histogram(self.buckets)
+            family[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled or not value:
+            return
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            family = self._counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def stages(self) -> List[Dict]:
+        """One row per timed stage: count, p50/p99 and mean in milliseconds."""
+        rows = []
+        with self._lock:
+            for key, hist in sorted(self._histograms.get("stage_seconds", {}).items()):
+                labels = dict(key)
+                rows.append({
+                    "stage": labels.pop("stage", ""),
+                    **labels,
+                    "count": hist.count,
+                    "p50_ms": round(hist.quantile(0.5) * 1000, 2),
+                    "p99_ms": round(hist.quantile(0.99) * 1000, 2),
+                    "mean_ms": round(hist.sum / hist.count * 1000, 2),
+                })
+        return rows
+
+    def counters(self) -> Dict[str, float]:
+        """Counter values keyed by name, with labels appended as in Prometheus (``name{k="v"}``)."""
+        with self._lock:
+            return {
+                name + _format_labels(key): value
+                for name, family in sorted(self._counters.items())
+                for key, value in sorted(family.items())
+            }
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, family in sorted(self._counters.items()):
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {full} counter")
+                for key, value in sorted(family.items()):
+                    lines.append(f"{full}{_format_labels(key)} {value:g}")
+            for name, family in sorted(self._histograms.items()):
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {full} histogram")
+                for key, hist in sorted(family.items()):
+                    cumulative = 0
+                    for bound, n in zip(list(hist.bounds) + ["+Inf"], hist.counts):
+                        cumulative += n
+                        le = bound if isinstance(bound, str) else f"{bound:g}"
+                        lines.append(f"{full}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {hist.sum:g}")
+                    lines.append(f"{full}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in key
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+# Shared by every module; set LUMINA_METRICS=0 to turn instrumentation off
+metrics = Metrics(enabled=os.environ.get("LUMINA_METRICS", "1").lower() not in ("0", "false", "no"))
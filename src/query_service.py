@@ -0,0 +1,445 @@
+"""Headless retrieval service: micro-batched query embedding and search over HTTP.
+
+    python -m src.query_service --port 8100
+
+Concurrent /search requests are collected for up to ``max_wait_ms`` (or until
+``max_batch`` arrive), embedded together (see ``QueryService._embed_queries``) and
+searched with one ``search_batch`` per filter group. The Streamlit app uses it
+through ``QueryClient`` when LUMINA_QUERY_SERVICE is set.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import numpy as np
+from langchain_core.documents import Document
+
+from src.local_store import validate_filters
+from src.metrics import metrics
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+INGEST_BATCH_SIZE = 64
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """Groups concurrently submitted items into batches for one ``handler`` call.
+
+    A batch closes when ``max_batch`` items are waiting or ``max_wait`` seconds
+    after its first item arrived. A new batch only starts collecting once fewer
+    than ``max_inflight`` are being processed, so requests that arrive while the
+    handler is busy all join the next batch instead of queueing behind tiny ones.
+    The handler may return an exception in place of one item's result to fail
+    just that request.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[List[Any]]], max_batch: int = 32,
+                 max_wait: float = 0.005, max_inflight: int = 1):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_inflight = max_inflight
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        self._tasks = set()
+        self._worker = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, *self._tasks, return_exceptions=True)
+            self._worker = None
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._inflight.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            metrics.inc("query_batches_total")
+            metrics.inc("queries_total", len(batch))
+            results = await self.handler([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._inflight.release()
+
+
+class QueryService:
+    """Serves search and ingestion for one EndeeService over a small JSON HTTP API.
+
+    Store access runs on a single worker thread, so searches and inserts never
+    interleave; query and document embedding each get their own thread.
+    """
+
+    def __init__(self, embed_model, vector_store, pipeline, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.embed_model = embed_model
+        # Query embeddings bypass the document cache (see CachedEmbeddings.embed_query)
+        self.query_encoder = getattr(embed_model, "underlying", embed_model)
+        self._batch_queries: Optional[bool] = None
+        self.vector_store = vector_store
+        self.pipeline = pipeline
+        self.batcher = MicroBatcher(self._search_many, max_batch=max_batch, max_wait=max_wait_ms / 1000)
+        self._query_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embed")
+        self._ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-embed")
+        self._store_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self._routes = {
+            ("GET", "/health"): self._health,
+            ("GET", "/sources"): self._sources,
+            ("GET", "/metrics"): self._metrics,
+            ("POST", "/search"): self._search,
+            ("POST", "/ingest/web"): self._ingest_web,
+            ("POST", "/ingest/pdf"): self._ingest_pdf,
+            ("POST", "/ingest/csv"): self._ingest_csv,
+            ("POST", "/ingest/json"): self._ingest_json,
+            ("POST", "/clear"): self._clear,
+        }
+
+    async def _run(self, pool: ThreadPoolExecutor, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+    # --- search ------------------------------------------------------------
+
+    def _search_groups(self, requests: List[Dict], vectors: List[List[float]]) -> List[Any]:
+        """One search_batch per distinct (filters, hybrid) combination in the batch.
+
+        A group that fails gets its exception as each member's result, so one
+        bad request never fails the other requests it was batched with.
+        """
+        groups: Dict[Tuple[str, bool], List[int]] = {}
+        for i, req in enumerate(requests):
+            key = (json.dumps(req.get("filters"), sort_keys=True), bool(req.get("hybrid", True)))
+            groups.setdefault(key, []).append(i)
+        results: List[Any] = [[] for _ in requests]
+        for (_, hybrid), members in groups.items():
+            k = max(requests[i]["k"] for i in members)
+            try:
+                found = self.vector_store.search_batch(
+                    [vectors[i] for i in members],
+                    k,
+                    filters=requests[members[0]].get("filters"),
+                    query_texts=[requests[i]["query"] for i in members] if hybrid else None,
+                )
+            except Exception as e:
+                found = [e] * len(members)
+            for i, hits in zip(members, found):
+                results[i] = hits if isinstance(hits, Exception) else hits[:requests[i]["k"]]
+        return results
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """The vectors ``embed_query`` would give, in one call when that is equivalent.
+
+        Encoders that treat queries differently (an instruction or prefix on the
+        query side) get one ``embed_query`` per text; the first batch probes
+        which kind of encoder this is.
+        """
+        if self._batch_queries is None:
+            single = self.query_encoder.embed_query(texts[0])
+            batched = self.query_encoder.embed_documents(texts[:1])[0]
+            self._batch_queries = bool(np.allclose(single, batched, atol=1e-5))
+            if not self._batch_queries:
+                print("Query encoder embeds queries differently from documents; embedding queries one at a time")
+        if self._batch_queries:
+            return self.query_encoder.embed_documents(texts)
+        return [self.query_encoder.embed_query(text) for text in texts]
+
+    async def _search_many(self, requests: List[Dict]) -> List[Any]:
+        with metrics.span("service.embed_batch"):
+            vectors = await self._run(self._query_pool, self._embed_queries, [r["query"] for r in requests])
+        with metrics.span("service.search_batch"):
+            return await self._run(self._store_pool, self._search_groups, requests, vectors)
+
+    async def _search(self, body: bytes, params: Dict) -> Dict:
+        req = json.loads(body or b"{}")
+        if not isinstance(req.get("query"), str) or not req["query"].strip():
+            raise ValueError("'query' must be a non-empty string")
+        req["k"] = int(req.get("k", 4))
+        # Rejected here, before batching, so a bad filter fails only its own request
+        validate_filters(req.get("filters"))
+        with metrics.span("service.search"):
+            return {"results": await self.batcher.submit(req)}
+
+    # --- ingestion ---------------------------------------------------------
+
+    async def _store_documents(self, docs: List[Document]) -> int:
+        docs, ids = await self._run(self._store_pool, self.vector_store.unseen, docs)
+        for start in range(0, len(docs), INGEST_BATCH_SIZE):
+            batch = docs[start:start + INGEST_BATCH_SIZE]
+            with metrics.span("ingest.embed"):
+                embeddings = await self._run(self._ingest_pool, self.embed_model.embed_documents,
+                                             [d.page_content for d in batch])
+            with metrics.span("ingest.insert"):
+                await self._run(self._store_pool, self.vector_store.add_documents, batch, embeddings,
+                                ids[start:start + INGEST_BATCH_SIZE])
+        return len(docs)
+
+    async def _ingest_web(self, body: bytes, params: Dict) -> Dict:
+        urls = [u for u in json.loads(body or b"{}").get("urls", []) if u.strip()]
+
+        def load():
+            docs = self.pipeline.load_web(urls)
+            return docs, dict(self.pipeline.fetch_errors)
+
+        docs, errors = await self._run(self._ingest_pool, load)
+        return {"chunks": await self._store_documents(docs), "errors": errors}
+
+    async def _ingest_pdf(self, body: bytes, params: Dict) -> Dict:
+        name = os.path.basename(params.get("name", ["upload.pdf"])[0])
+
+        def load():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, name)
+                with open(path, "wb") as f:
+                    f.write(body)
+                docs = self.pipeline.load_pdfs([path])
+            for doc in docs:
+                doc.metadata["source"] = name
+            return docs
+
+        docs = await self._run(self._ingest_pool, load)
+        return {"chunks": await self._store_documents(docs)}
+
+    async def _ingest_csv(self, body: bytes, params: Dict) -> Dict:
+        # The file travels in the body, like PDFs: the service never opens paths named by a client.
+        # ``source`` only labels the rows, so later syncs of the same file replace them.
+        source = params.get("source", ["upload.csv"])[0]
+
+        def load():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "upload.csv")
+                with open(path, "wb") as f:
+                    f.write(body)
+                docs = self.pipeline.load_csv(path)
+            for doc in docs:
+                doc.metadata["source"] = source
+            return docs
+
+        docs = await self._run(self._ingest_pool, load)
+        if not docs:
+            return {"records": 0, "added": 0, "deleted": 0, "unchanged": 0, "delete_failed": 0}
+        stats = await self._run(self._store_pool, self.vector_store.sync_source, source, docs, self.embed_model)
+        return {"records": len(docs), **vars(stats)}
+
+    async def _ingest_json(self, body: bytes, params: Dict) -> Dict:
+        req = json.loads(body or b"{}")
+        docs = self.pipeline.load_json(req.get("data"), req.get("source", "API_Response"))
+        return {"chunks": await self._store_documents(docs)}
+
+    # --- status ------------------------------------------------------------
+
+    async def _health(self, body: bytes, params: Dict) -> Dict:
+        return {
+            "status": "ok",
+            "connected": self.vector_store.connected,
+            "items": len(self.vector_store.local_store),
+        }
+
+    async def _sources(self, body: bytes, params: Dict) -> Dict:
+        values = await self._run(self._store_pool, self.vector_store.local_store.field_values, "source")
+        return {"sources": values}
+
+    async def _metrics(self, body: bytes, params: Dict) -> str:
+        return metrics.prometheus()
+
+    async def _clear(self, body: bytes, params: Dict) -> Dict:
+        await self._run(self._store_pool, self.vector_store.clear_data)
+        return {"cleared": True}
+
+    # --- HTTP --------------------------------------------------------------
+
+    async def _respond(self, method: str, target: str, body: bytes) -> Tuple[int, bytes, str]:
+        url = urlsplit(target)
+        route = self._routes.get((method, url.path.rstrip("/") or "/"))
+        if route is None:
+            return 404, json.dumps({"error": f"no route for {method} {url.path}"}).encode(), "application/json"
+        try:
+            payload = await route(body, parse_qs(url.query))
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode(), "application/json"
+        except Exception as e:
+            print(f"Query service error on {method} {url.path}: {e}")
+            return 500, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode(), "application/json"
+        if isinstance(payload, str):
+            return 200, payload.encode("utf-8"), "text/plain; version=0.0.4"
+        return 200, json.dumps(payload, default=str).encode("utf-8"), "application/json"
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Minimal HTTP/1.1 with keep-alive; enough for QueryClient, curl and Prometheus."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    status, payload, content_type = 413, b'{"error": "request body too large"}', "application/json"
+                    headers["connection"] = "close"
+                else:
+                    body = await reader.readexactly(length)
+                    status, payload, content_type = await self._respond(method.upper(), target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8100, ready: Optional[asyncio.Event] = None):
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"Lumina query service listening on http://{host}:{self.port}")
+        if ready:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+class QueryClient:
+    """Thin synchronous client for QueryService, used by the Streamlit app."""
+
+    def __init__(self, base_url: str, timeout: float = 30.0, ingest_timeout: float = 600.0):
+        self.base_url = base_url.rstrip("/")
+        self.ingest_timeout = ingest_timeout
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout)
+
+    def _post(self, path: str, timeout: Optional[float] = None, **kwargs) -> Dict:
+        resp = self._client.post(path, timeout=timeout or self._client.timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _get(self, path: str) -> Dict:
+        resp = self._client.get(path)
+        resp.raise_for_status()
+        return resp.json()
+
+    def search(self, query: str, k: int = 4, filters: Optional[Dict[str, Any]] = None,
+               hybrid: bool = True) -> List[Dict]:
+        return self._post("/search", json={"query": query, "k": k, "filters": filters, "hybrid": hybrid})["results"]
+
+    def health(self) -> Dict:
+        return self._get("/health")
+
+    def sources(self) -> List[str]:
+        return self._get("/sources")["sources"]
+
+    def ingest_web(self, urls: List[str]) -> Dict:
+        return self._post("/ingest/web", timeout=self.ingest_timeout, json={"urls": urls})
+
+    def ingest_pdf(self, name: str, data: bytes) -> Dict:
+        return self._post("/ingest/pdf", timeout=self.ingest_timeout, params={"name": name}, content=data)
+
+    def sync_csv(self, path: str, source: Optional[str] = None) -> Dict:
+        """Uploads the CSV at ``path``; its rows are synced under ``source`` (default: the path)."""
+        with open(path, "rb") as f:
+            data = f.read()
+        return self._post("/ingest/csv", timeout=self.ingest_timeout, params={"source": source or path}, content=data)
+
+    def ingest_json(self, data: Any, source: str = "API_Response") -> Dict:
+        return self._post("/ingest/json", timeout=self.ingest_timeout, json={"data": data, "source": source})
+
+    def clear(self) -> Dict:
+        return self._post("/clear")
+
+    def close(self):
+        self._client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lumina AI headless query service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--max-batch", type=int, default=32, help="queries per embedding/search batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="how long a batch waits to fill")
+    parser.add_argument("--persist-dir", default=os.path.join("data", "local_store"))
+    parser.add_argument("--endee-url", default=None)
+    args = parser.parse_args()
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    from src.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from src.ingestion import IngestionPipeline
+    from src.vector_store import EndeeService
+
+    model_name = "all-MiniLM-L6-v2"
+    embed_model = CachedEmbeddings(
+        HuggingFaceEmbeddings(model_name=model_name),
+        EmbeddingCache(model_name, path=os.path.join("data", "embedding_cache.sqlite")),
+    )
+    vector_store = EndeeService(
+        collection_name="enterprise_knowledge",
+        dimension=384,
+        persist_dir=args.persist_dir,
+        base_url=args.endee_url,
+    )
+    service = QueryService(embed_model, vector_store, IngestionPipeline(),
+                           max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        vector_store.local_store.close()
+
+
+if __name__ == "__main__":
+    main()
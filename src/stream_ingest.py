@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.metrics import metrics
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+@dataclass
+class IngestProgress:
+    batches: int = 0
+    chunks: int = 0
+    skipped_duplicates: int = 0
+    seconds: float = 0.0
+
+
+def batched(docs: Iterable[Document], batch_size: int) -> Iterator[List[Document]]:
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Stage(threading.Thread):
+    """Runs ``work`` over items from ``source`` and puts results on a bounded queue."""
+
+    def __init__(self, source: Iterable, work: Callable, out: queue.Queue, stop: threading.Event):
+        super().__init__(daemon=True)
+        self.source, self.work, self.out, self.stop = source, work, out, stop
+        self.error: Optional[BaseException] = None
+
+    def _put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        try:
+            for item in self.source:
+                if not self._put(self.work(item)):
+                    return
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._put(_DONE)
+
+
+def _drain(q: queue.Queue, stop: threading.Event) -> Iterator:
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def stream_ingest(chunks: Iterable[Document], embed_model: Embeddings, vector_store,
+                  batch_size: int = 64, max_pending: int = 2, dedupe: bool = True,
+                  on_batch: Optional[Callable[[IngestProgress], None]] = None) -> IngestProgress:
+    """Pipes chunks through loader/splitter -> embedder -> vector store in fixed-size batches.
+
+    Loading and embedding run on their own threads, joined by queues holding at
+    most ``max_pending`` batches, so memory stays bounded regardless of input size.
+    Each batch is inserted into ``vector_store`` as soon as it is embedded, on the
+    calling thread, which then calls ``on_batch`` with the running totals.
+    With ``dedupe``, chunks already stored or repeated in the stream are skipped
+    before embedding (see EndeeService.unseen).
+    """
+    progress = IngestProgress()
+    started = time.perf_counter()
+    seen = set()
+
+    def unique(batch: List[Document]) -> Tuple[List[Document], Optional[List[str]]]:
+        if not dedupe:
+            return batch, None
+        kept, ids = vector_store.unseen(batch, seen)
+        progress.skipped_duplicates += len(batch) - len(kept)
+        return kept, ids
+
+    def load() -> Iterator[List[Document]]:
+        batches = batched(chunks, batch_size)
+        while True:
+            # Pulling a batch is where the source loads and splits
+            with metrics.span("ingest.load_split"):
+                batch = next(batches, None)
+            if batch is None:
+                return
+            yield unique(batch)
+
+    def embed(item: Tuple[List[Document], Optional[List[str]]]):
+        batch, ids = item
+        if not batch:
+            return batch, ids, []
+        with metrics.span("ingest.embed"):
+            return batch, ids, embed_model.embed_documents([d.page_content for d in batch])
+
+    stop = threading.Event()
+    loaded, embedded = queue.Queue(max_pending), queue.Queue(max_pending)
+    loader = _Stage(load(), lambda b: b, loaded, stop)
+    embedder = _Stage(_drain(loaded, stop), embed, embedded, stop)
+    loader.start()
+    embedder.start()
+    try:
+        for batch, ids, embeddings in _drain(embedded, stop):
+            if not batch:
+                continue
+            with metrics.span("ingest.insert"):
+                vector_store.add_documents(batch, embeddings, ids=ids)
+            progress.batches += 1
+            progress.chunks += len(batch)
+            progress.seconds = time.perf_counter() - started
+            if on_batch:
+                on_batch(progress)
+    finally:
+        stop.set()
+        loader.join()
+        embedder.join()
+    for stage in (loader, embedder):
+        if stage.error is not None:
+            raise stage.error
+    progress.seconds = time.perf_counter() - started
+    return progress
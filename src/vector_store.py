@@ -1,23 +1,76 @@
-import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple
 from endee import Endee
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
+import json
+import os
 import time
 import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from src.embedding_cache import content_hash
+from src.local_store import LocalVectorStore, FILTER_FIELDS, RANGE_FIELDS
+from src.lexical import reciprocal_rank_fusion
+from src.metrics import metrics
+
+# Metadata that records where a chunk sits rather than what it says; kept out of
+# chunk ids so inserting or removing one CSV row or PDF page doesn't renumber the rest
+POSITIONAL_FIELDS = ("row", "page", "page_label", "total_pages")
+
+
+@dataclass
+class InsertStats:
+    inserted: int = 0
+    failed: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Vectors accepted by Endee per second."""
+        return self.inserted / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class SyncStats:
+    added: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    # Stale chunks Endee failed to delete; kept and retried on the next sync
+    delete_failed: int = 0
+
 
 class EndeeService:
-    def __init__(self, collection_name: str, dimension: int = 384):
+    def __init__(self, collection_name: str, dimension: int = 384, persist_dir: Optional[str] = None,
+                 local_index: str = "flat", nprobe: int = 8, quantization: str = "none",
+                 base_url: Optional[str] = None,
+                 client: Any = None, insert_batch_size: int = 256, max_concurrent_inserts: int = 4,
+                 insert_retries: int = 3, retry_backoff: float = 0.5):
         self.collection_name = collection_name
         self.dimension = dimension
+        self.persist_dir = persist_dir
+        # source -> chunk ids currently stored for it; loaded on first sync
+        self._sources: Optional[Dict[str, List[str]]] = None
         self.client = None
         self.index = None
         self.connected = False
+        self.insert_batch_size = insert_batch_size
+        self.max_concurrent_inserts = max_concurrent_inserts
+        self.insert_retries = insert_retries
+        self.retry_backoff = retry_backoff
+        self.last_insert_stats = InsertStats()
         
         # Try connecting
         try:
-            # Endee() defaults to http://127.0.0.1:8080/api/v1 which is perfect for local Docker
-            self.client = Endee(token="admin_secret")
+            # Endee() defaults to http://127.0.0.1:8080/api/v1 which is perfect for local Docker.
+            # A pre-built client (e.g. a local stand-in) can be passed in instead.
+            self.client = client or Endee(token="admin_secret")
+            if base_url and client is None:
+                self.client.set_base_url(base_url)
             # Simple health check or list_indexes to verify connection
             indexes = self.client.list_indexes()
             self.connected = True
@@ -27,8 +80,13 @@ class EndeeService:
             print(f"❌ Could not connect to Endee Server: {e}")
             print("Running in OFFLINE/MOCK mode.")
 
-        # In-memory fallback
-        self.mock_store = []
+        # Fallback and text/metadata store for Endee hits. With persist_dir set it is
+        # memory-mapped from disk, so restarts don't require re-embedding.
+        # local_index="ivf" swaps the brute-force scan for an IVF index; quantization
+        # ("float16"/"int8") scans compact codes and rescores the top candidates exactly.
+        self.local_store = LocalVectorStore(
+            dimension, path=persist_dir, index=local_index, nprobe=nprobe, quantization=quantization
+        )
 
     def _setup_index(self):
         try:
@@ -44,101 +102,339 @@ class EndeeService:
             print(f"Error setting up index: {e}")
             self.connected = False
 
-    def add_documents(self, documents: List[Document], embeddings: List[List[float]]):
-        ids = [str(uuid.uuid4()) for _ in documents]
-        
-        if self.connected and self.index:
+    def _insert_batch(self, records: List[Dict]) -> int:
+        """Sends one batch to Endee, retrying with exponential backoff. Returns retries used."""
+        for attempt in range(self.insert_retries + 1):
             try:
-                # Assuming insert API: index.insert(vectors, ids=..., metadata=...)
-                # The metadata support in Endee might be specific.
-                # If inspection failed to show methods, I'll assume standard args.
-                # If it fails, we fall back.
-                
-                # Check for `insert` or `add`
-                if hasattr(self.index, 'insert'):
-                    # Vector native usually expects vectors + ids
-                    self.index.insert(vectors=embeddings, ids=ids) 
-                    # Metadata store might be separate or embedded?
-                    # For a strict vector DB, we might only check sim.
-                    # We will store metadata in self.mock_store even in connected mode 
-                    # if Endee is pure vector? No, usually they support payloads.
-                    # I'll chance it with a 'metadata' arg or 'payload' arg.
-                    pass
-                elif hasattr(self.index, 'add'):
-                    self.index.add(embeddings)
-                
+                with metrics.span("insert.endee_batch"):
+                    if hasattr(self.index, 'upsert'):
+                        # Payloads ride along as 'meta', so hits can be hydrated server-side
+                        self.index.upsert(records)
+                    elif hasattr(self.index, 'insert'):
+                        self.index.insert(vectors=[r['vector'] for r in records], ids=[r['id'] for r in records])
+                    elif hasattr(self.index, 'add'):
+                        self.index.add([r['vector'] for r in records])
+                return attempt
             except Exception as e:
-                print(f"Endee Insert Failed: {e}")
-        
-        # Always store in mock_store for retrieval of Text/Metadata if DB is pure vector
-        # or as fallback.
-        for doc, emb, id_ in zip(documents, embeddings, ids):
-            self.mock_store.append({
+                if attempt == self.insert_retries:
+                    raise
+                print(f"Endee Insert Failed (attempt {attempt + 1}), retrying: {e}")
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def _insert_remote(self, ids: List[str], documents: List[Document],
+                       embeddings: List[List[float]]) -> InsertStats:
+        """Inserts in batches of insert_batch_size, at most max_concurrent_inserts in flight."""
+        stats = InsertStats()
+        started = time.perf_counter()
+        records = [
+            {
                 "id": id_,
-                "vector": emb,
-                "text": doc.page_content,
-                "metadata": doc.metadata
-            })
+                "vector": list(map(float, emb)),
+                # default=str keeps non-JSON metadata (dates, paths) from failing the batch
+                "meta": json.loads(json.dumps({"text": doc.page_content, **doc.metadata}, default=str)),
+                # Indexed server-side so searches can filter on them
+                "filter": {
+                    field: doc.metadata[field] if field in RANGE_FIELDS else str(doc.metadata[field])
+                    for field in FILTER_FIELDS + RANGE_FIELDS if field in doc.metadata
+                },
+            }
+            for id_, doc, emb in zip(ids, documents, embeddings)
+        ]
+        batches = [records[i:i + self.insert_batch_size] for i in range(0, len(records), self.insert_batch_size)]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrent_inserts)) as pool:
+            futures = [pool.submit(self._insert_batch, batch) for batch in batches]
+            for batch, future in zip(batches, futures):
+                stats.batches += 1
+                try:
+                    stats.retries += future.result()
+                    stats.inserted += len(batch)
+                except Exception as e:
+                    print(f"Endee Insert Failed: {e}")
+                    stats.failed_batches += 1
+                    stats.failed += len(batch)
+        stats.seconds = time.perf_counter() - started
+        metrics.observe("stage_seconds", stats.seconds, stage="insert.endee")
+        metrics.inc("insert_failures_total", stats.failed)
+        metrics.inc("insert_retries_total", stats.retries)
+        print(
+            f"Endee: inserted {stats.inserted} vectors in {stats.batches} batches "
+            f"({stats.throughput:.0f}/s), {stats.failed} failed, {stats.retries} retries."
+        )
+        return stats
 
-    def search(self, query_vector: List[float], k: int = 4) -> List[Dict]:
-        results = []
+    def add_documents(self, documents: List[Document], embeddings: List[List[float]],
+                      ids: Optional[List[str]] = None) -> InsertStats:
+        ids = ids or [str(uuid.uuid4()) for _ in documents]
         
+        self.last_insert_stats = InsertStats()
         if self.connected and self.index:
-            try:
-                # Attempt search
-                # Expected return: matches with id, score
-                search_res = []
+            self.last_insert_stats = self._insert_remote(ids, documents, embeddings)
+        
+        # Always store in local_store for retrieval of Text/Metadata if DB is pure vector
+        # or as fallback.
+        with metrics.span("insert.local"):
+            self.local_store.add(
+                ids,
+                embeddings,
+                [doc.page_content for doc in documents],
+                [doc.metadata for doc in documents],
+            )
+        if metrics.enabled:
+            for source, n in Counter(doc.metadata.get("source", "unknown") for doc in documents).items():
+                metrics.inc("chunks_ingested_total", n, source=source)
+        return self.last_insert_stats
+
+    def delete(self, ids: List[str]) -> List[str]:
+        """Removes vectors by id from Endee and the local store.
+
+        Returns the ids Endee failed to delete. Those stay in the local store
+        as well, so local and remote agree until the caller retries them.
+        """
+        failed = []
+        if self.connected and self.index and ids:
+            def delete_one(id_) -> bool:
+                try:
+                    if hasattr(self.index, 'delete_vector'):
+                        self.index.delete_vector(id_)
+                    elif hasattr(self.index, 'delete'):
+                        self.index.delete(id_)
+                    return True
+                except Exception as e:
+                    metrics.inc("delete_failures_total")
+                    print(f"Endee Delete Failed for {id_}: {e}")
+                    return False
+
+            with ThreadPoolExecutor(max_workers=max(1, self.max_concurrent_inserts)) as pool:
+                failed = [id_ for id_, ok in zip(ids, pool.map(delete_one, ids)) if not ok]
+        kept = set(failed)
+        self.local_store.delete([id_ for id_ in ids if id_ not in kept])
+        return failed
+
+    # --- incremental per-source sync ---------------------------------------
+
+    def _sources_path(self) -> Optional[str]:
+        return os.path.join(self.persist_dir, "sources.json") if self.persist_dir else None
+
+    def _source_index(self) -> Dict[str, List[str]]:
+        if self._sources is None:
+            self._sources = {}
+            path = self._sources_path()
+            if path and os.path.exists(path):
+                with open(path) as f:
+                    self._sources = json.load(f)
+        return self._sources
+
+    def _save_source_index(self):
+        path = self._sources_path()
+        if path:
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._source_index(), f)
+            os.replace(tmp, path)
+
+    @staticmethod
+    def chunk_id(source: str, doc: Document) -> str:
+        """Content-derived id: the same chunk of the same source always maps to the same id.
+
+        POSITIONAL_FIELDS are left out, so a chunk keeps its id when rows or
+        pages before it are added or removed.
+        """
+        metadata = {k: v for k, v in doc.metadata.items() if k not in POSITIONAL_FIELDS}
+        return content_hash(source, doc.page_content, json.dumps(metadata, sort_keys=True, default=str))
+
+    def unseen(self, documents: List[Document],
+               seen: Optional[Set[str]] = None) -> Tuple[List[Document], List[str]]:
+        """Drops chunks already in the store or repeated earlier; returns the rest with their ids.
+
+        Ids are chunk_ids, so passing them on to add_documents makes re-ingesting
+        a file a no-op instead of a second copy. ``seen`` carries ids across
+        calls, e.g. the batches of one stream.
+        """
+        seen = set() if seen is None else seen
+        kept, ids = [], []
+        for doc in documents:
+            id_ = self.chunk_id(str(doc.metadata.get("source", "")), doc)
+            if id_ in seen or self.local_store.row_of(id_) is not None:
+                continue
+            seen.add(id_)
+            kept.append(doc)
+            ids.append(id_)
+        return kept, ids
+
+    def sync_source(self, source: str, documents: List[Document], embed_model: Embeddings) -> SyncStats:
+        """Brings one source up to date with ``documents``, touching only what changed.
+
+        Chunks are identified by a hash of their text and non-positional metadata
+        (see chunk_id). New or changed chunks are embedded and inserted, chunks
+        that disappeared from the source are deleted, and unchanged chunks are
+        left alone, including their stored row/page numbers. Stale chunks Endee
+        fails to delete are kept and retried on the next sync.
+        """
+        sources = self._source_index()
+        current = {}
+        for doc in documents:
+            current.setdefault(self.chunk_id(source, doc), doc)
+        previous = set(sources.get(source, []))
+
+        stats = SyncStats(unchanged=len(previous & current.keys()))
+        new_ids = [id_ for id_ in current if id_ not in previous]
+        if new_ids:
+            new_docs = [current[id_] for id_ in new_ids]
+            embeddings = embed_model.embed_documents([d.page_content for d in new_docs])
+            self.add_documents(new_docs, embeddings, ids=new_ids)
+            stats.added = len(new_ids)
+        stale = [id_ for id_ in previous if id_ not in current]
+        failed = self.delete(stale) if stale else []
+        stats.deleted = len(stale) - len(failed)
+        stats.delete_failed = len(failed)
+
+        # Failed deletes stay listed under the source, so the next sync retries them
+        sources[source] = list(current) + failed
+        self._save_source_index()
+        return stats
+
+    @staticmethod
+    def _endee_filter(filters: Dict[str, Any]) -> List[Dict]:
+        """Translates search filters into Endee's filter syntax."""
+        clauses = []
+        for field, wanted in filters.items():
+            if field in RANGE_FIELDS:
+                low, high = wanted if isinstance(wanted, (list, tuple)) else (wanted, wanted)
+                clauses.append({field: {"$range": [low, high]}})
+            elif isinstance(wanted, (list, tuple, set)):
+                clauses.append({field: {"$in": [str(v) for v in wanted]}})
+            else:
+                clauses.append({field: {"$eq": str(wanted)}})
+        return clauses
+
+    def _search_endee(self, query_vector: List[float], k: int,
+                      filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        """Queries the Endee index and hydrates the hits from local_store; [] on failure."""
+        try:
+            # Attempt search
+            # Expected return: matches with id, score
+            search_res = []
+            with metrics.span("search.endee"):
                 if hasattr(self.index, 'query'):
-                    search_res = self.index.query(vector=query_vector, top_k=k)
+                    if filters:
+                        search_res = self.index.query(vector=query_vector, top_k=k, filter=self._endee_filter(filters))
+                    else:
+                        search_res = self.index.query(vector=query_vector, top_k=k)
                 elif hasattr(self.index, 'search'):
+                    if filters:
+                        # No server-side filtering on this client; let the local store answer
+                        return []
                     search_res = self.index.search(query_vector=query_vector, limit=k)
-                    
-                # Process results - assuming search_res is list of objects/dicts
-                # If we get IDs, we look up in mock_store (hybrid approach)
-                # This guarantees we get the text back.
-                for res in search_res:
-                    # Normalized result handling
-                    rid = getattr(res, 'id', None) or res.get('id')
-                    score = getattr(res, 'score', 0.0) or res.get('score', 0.0)
-                    
-                    # Find doc
-                    doc = next((d for d in self.mock_store if d['id'] == rid), None)
-                    if doc:
-                        doc['score'] = score
-                        results.append(doc)
-                        
-                if results:
-                    return results
-            except Exception as e:
-                print(f"Endee Search Failed: {e}")
 
-        # Fallback: Cosine Similarity on mock_store
-        print("Using Fallback Search")
-        if not self.mock_store:
-            return []
-            
-        vecs = np.array([d['vector'] for d in self.mock_store])
-        q = np.array(query_vector)
-        
-        norm_v = np.linalg.norm(vecs, axis=1)
-        norm_q = np.linalg.norm(q)
-        
-        if norm_q == 0:
+            # Process results - assuming search_res is list of objects/dicts
+            # If we get IDs, we look up in local_store (hybrid approach)
+            # This guarantees we get the text back.
+            rids, scores, payloads = [], [], []
+            for res in search_res:
+                # Normalized result handling
+                if isinstance(res, dict):
+                    rids.append(res.get('id'))
+                    scores.append(res.get('score', res.get('similarity', 0.0)) or 0.0)
+                    payloads.append(res.get('meta'))
+                else:
+                    rids.append(getattr(res, 'id', None))
+                    scores.append(getattr(res, 'score', 0.0) or 0.0)
+                    payloads.append(getattr(res, 'meta', None))
+
+            # Single batched id -> row lookup, independent of corpus size; ids missing
+            # locally are served from the payload stored with the vector
+            with metrics.span("search.hydrate"):
+                return self.local_store.hydrate(rids, scores, payloads)
+        except Exception as e:
+            metrics.inc("endee_search_errors_total")
+            print(f"Endee Search Failed: {e}")
             return []
-            
-        sims = np.dot(vecs, q) / (norm_v * norm_q)
-        top_idx = np.argsort(sims)[::-1][:k]
-        
-        for idx in top_idx:
-            item = self.mock_store[idx]
-            item['score'] = float(sims[idx])
-            results.append(item)
-            
+
+    def search(self, query_vector: List[float], k: int = 4, query_text: Optional[str] = None,
+               candidates: int = 50, filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        """Vector search, or hybrid search when ``query_text`` is given.
+
+        Hybrid mode takes the top ``candidates`` from vector search and from the
+        local BM25 index and fuses the two rankings with reciprocal rank fusion,
+        so exact terms (customer ids, error codes) surface even when their
+        embeddings are not the closest. ``score`` is then the normalised fused
+        score and ``similarity`` the cosine, for hits vector search found.
+
+        ``filters`` (e.g. ``{"source": "a.pdf", "page": (1, 5)}``) restrict the
+        search to matching chunks: pushed down to Endee when connected and
+        resolved to a candidate mask before scoring in the local store.
+        """
+        if query_text:
+            n = max(candidates, k)
+            vector_hits = self._vector_search(query_vector, n, filters)
+            with metrics.span("search.lexical"):
+                lexical_hits = self.local_store.search_lexical(query_text, n, filters=filters)
+            return self._fuse(vector_hits, lexical_hits, k)
+        return self._vector_search(query_vector, k, filters)
+
+    @staticmethod
+    def _fuse(vector_hits: List[Dict], lexical_hits: List[Dict], k: int) -> List[Dict]:
+        """RRF of the two rankings; hits found by vector search keep their cosine as ``similarity``."""
+        with metrics.span("search.fusion"):
+            fused = reciprocal_rank_fusion([vector_hits, lexical_hits], k)
+            dense = {hit["id"]: hit["score"] for hit in vector_hits}
+            for hit in fused:
+                if hit["id"] in dense:
+                    hit["similarity"] = dense[hit["id"]]
+            return fused
+
+    def _vector_search(self, query_vector: List[float], k: int,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        if self.connected and self.index:
+            results = self._search_endee(query_vector, k, filters)
+            if results:
+                return results
+
+        # Fallback: Cosine Similarity on local_store
+        print("Using Fallback Search")
+        metrics.inc("fallback_searches_total")
+        with metrics.span("search.local"):
+            return self.local_store.search(query_vector, k, filters=filters)
+
+    def search_batch(self, query_vectors: List[List[float]], k: int = 4, max_workers: int = 8,
+                     filters: Optional[Dict[str, Any]] = None, query_texts: Optional[List[str]] = None,
+                     candidates: int = 50) -> List[List[Dict]]:
+        """Searches several queries at once, returning one result list per query in input order.
+
+        Connected: queries fan out to Endee concurrently. Queries Endee could not
+        answer, or all of them when offline, are scored together by the local store.
+        With ``query_texts``, each query is fused with BM25 matches as in search().
+        """
+        if query_texts:
+            n = max(candidates, k)
+            vector_hits = self.search_batch(query_vectors, n, max_workers, filters)
+            fused = []
+            for hits, text in zip(vector_hits, query_texts):
+                with metrics.span("search.lexical"):
+                    lexical_hits = self.local_store.search_lexical(text, n, filters=filters)
+                fused.append(self._fuse(hits, lexical_hits, k))
+            return fused
+
+        results: List[List[Dict]] = [[] for _ in query_vectors]
+        if self.connected and self.index and results:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(results))) as pool:
+                results = list(pool.map(lambda q: self._search_endee(q, k, filters), query_vectors))
+
+        missing = [i for i, r in enumerate(results) if not r]
+        if missing:
+            print("Using Fallback Search")
+            metrics.inc("fallback_searches_total", len(missing))
+            with metrics.span("search.local_batch"):
+                fallback = self.local_store.search_batch([query_vectors[i] for i in missing], k, filters=filters)
+            for i, res in zip(missing, fallback):
+                results[i] = res
         return results
 
     def clear_data(self):
-        """Clears all data from the Endee Server and the local mock store."""
-        self.mock_store = []
+        """Clears all data from the Endee Server and the local store."""
+        self.local_store.clear()
+        self._sources = {}
+        self._save_source_index()
         if self.connected and self.client:
             try:
                 self.client.delete_index(self.collection_name)
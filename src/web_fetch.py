@@ -0,0 +1,84 @@
+import asyncio
+import concurrent.futures
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; LuminaAI/1.0; +https://github.com/EndeeLabs/endee)",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+}
+# Worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchResult:
+    url: str
+    text: Optional[str] = None
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def _fetch_one(client: httpx.AsyncClient, url: str, host_limit: asyncio.Semaphore,
+                     retries: int, backoff: float) -> FetchResult:
+    async with host_limit:
+        for attempt in range(retries + 1):
+            try:
+                resp = await client.get(url)
+                if resp.status_code in RETRY_STATUSES and attempt < retries:
+                    await asyncio.sleep(backoff * 2 ** attempt)
+                    continue
+                if resp.status_code >= 400:
+                    return FetchResult(url, status=resp.status_code, error=f"HTTP {resp.status_code}")
+                return FetchResult(url, text=resp.text, status=resp.status_code)
+            except Exception as e:
+                # Timeouts and connection errors are retried; bad URLs etc. are not
+                if isinstance(e, httpx.TransportError) and attempt < retries:
+                    await asyncio.sleep(backoff * 2 ** attempt)
+                    continue
+                return FetchResult(url, error=f"{type(e).__name__}: {e}")
+
+
+async def fetch_all(urls: List[str], max_connections: int = 32, max_per_host: int = 4,
+                    timeout: float = 15.0, retries: int = 2, backoff: float = 0.5,
+                    client: Optional[httpx.AsyncClient] = None) -> List[FetchResult]:
+    """Fetches URLs concurrently over one pooled client; results keep the input order.
+
+    Failures are reported per URL in ``FetchResult.error`` instead of raising.
+    """
+    host_limits = defaultdict(lambda: asyncio.Semaphore(max_per_host))
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+    try:
+        tasks = []
+        for url in urls:
+            host = urlsplit(url).netloc
+            tasks.append(_fetch_one(client, url, host_limits[host], retries, backoff))
+        return await asyncio.gather(*tasks)
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+def fetch_urls(urls: List[str], **kwargs) -> List[FetchResult]:
+    """Synchronous wrapper around fetch_all, safe to call from inside a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(fetch_all(urls, **kwargs))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, fetch_all(urls, **kwargs)).result()